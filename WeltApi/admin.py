@@ -6,13 +6,18 @@ from typing import Optional, List
 from fastapi import APIRouter, HTTPException, Depends, Query, UploadFile, File, Form
 from pydantic import BaseModel
 from uuid import UUID, uuid4
-from sqlalchemy import select, func
+from sqlalchemy import select, func, update
+from sqlalchemy.exc import IntegrityError
 from starlette import status
 
-from auth import get_current_user_with_roles, get_current_user
-from database import db_dependency
+from auth import get_current_user_with_roles, get_current_user, invalidate_principal
+from database import db_dependency, read_db_dependency
 from models import Role, Project, User, ProjectUser, Chat, RequestStatus, ChatParticipant, Request, TaskStatus, \
     TaskPriority, Task, TaskAssignment
+from query_stats import slow_query_log
+from reference_data import roles, request_statuses, task_statuses, task_priorities, invalidate_reference
+from my_websockets import publish_project_event
+from tasks import validate_assignees, publish_task_created, rank_at_end
 from settings import BASE_URL
 
 router = APIRouter(
@@ -37,10 +42,7 @@ class IdRequest(BaseModel):
 
 @router.post('/create-role', summary="Создание новой роли")
 async def create_role(db: db_dependency, data: CreateRoleRequest):
-    query = select(Role).where(Role.title == data.title)
-    result = await db.execute(query)
-    role = result.scalar_one_or_none()
-    if role is not None:
+    if roles.get_by_title(data.title) is not None:
             raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Роль с таким названием уже есть в базе данных"
@@ -51,9 +53,10 @@ async def create_role(db: db_dependency, data: CreateRoleRequest):
     db.add(role)
     await db.commit()
     await db.refresh(role)
+    await invalidate_reference(roles)
 
 @router.get('/all-roles', summary="Получение всех ролей")
-async def get_all_roles(db: db_dependency, page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
+async def get_all_roles(db: read_db_dependency, page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
     offset = page * per_page
 
     query = select(Role).offset(offset).limit(per_page)
@@ -73,7 +76,7 @@ async def get_all_roles(db: db_dependency, page: int = Query(0, ge=0, descriptio
     }
 
 @router.get('/all-task-statuses', summary="Получение всех статусов задач")
-async def get_all_task_statuses(db: db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
+async def get_all_task_statuses(db: read_db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
     offset = page * per_page
 
     query = select(TaskStatus).offset(offset).limit(per_page)
@@ -129,9 +132,7 @@ async def create_request(
             detail="Пользователь-получатель не найден"
         )
 
-    status_query = select(RequestStatus).where(RequestStatus.title == "IN PROGRESS")
-    status_result = await db.execute(status_query)
-    request_status = status_result.scalar_one_or_none()
+    request_status = request_statuses.get_by_title("IN PROGRESS")
     if not request_status:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -178,7 +179,7 @@ async def create_request(
     }
 
 @router.get('/all-task-priorities', summary="Получение всех приоритетов задач")
-async def get_all_task_priorities(db: db_dependency, current_user: dict = Depends(get_current_user), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
+async def get_all_task_priorities(db: read_db_dependency, current_user: dict = Depends(get_current_user), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
     offset = page * per_page
 
     query = select(TaskPriority).offset(offset).limit(per_page)
@@ -198,7 +199,7 @@ async def get_all_task_priorities(db: db_dependency, current_user: dict = Depend
     }
 
 @router.get('/all-tasks', summary="Получение всех задач")
-async def get_all_tasks(db: db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
+async def get_all_tasks(db: read_db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
     offset = page * per_page
 
     query = select(Task).offset(offset).limit(per_page)
@@ -228,16 +229,22 @@ async def delete_role(db: db_dependency, data: DeleteRoleRequest):
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Роли с таким id нет в базе данных"
         )
+    # Токены с claims удаляемой роли больше не действительны
+    await db.execute(
+        update(User)
+        .where(User.role_id == role.id)
+        .values(token_version=User.token_version + 1)
+    )
     await db.delete(role)
     await db.commit()
+    await invalidate_reference(roles)
+    # Пользователи удалённой роли получили роль по умолчанию
+    await invalidate_principal()
 
 
 @router.post('/create-request-status', summary="Создание нового статуса заявки")
 async def create_request_status(db: db_dependency, data: CreateRequestStatusRequest):
-    query = select(RequestStatus).where(RequestStatus.title == data.title)
-    result = await db.execute(query)
-    request_status = result.scalar_one_or_none()
-    if request_status is not None:
+    if request_statuses.get_by_title(data.title) is not None:
             raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Статус с таким названием уже есть в базе данных"
@@ -248,6 +255,7 @@ async def create_request_status(db: db_dependency, data: CreateRequestStatusRequ
     db.add(request_status)
     await db.commit()
     await db.refresh(request_status)
+    await invalidate_reference(request_statuses)
 
 @router.delete('/delete-request-status', summary="Удаление статуса заявки по id")
 async def delete_request_status(db: db_dependency, data: DeleteRoleRequest):
@@ -261,10 +269,11 @@ async def delete_request_status(db: db_dependency, data: DeleteRoleRequest):
         )
     await db.delete(request_status)
     await db.commit()
+    await invalidate_reference(request_statuses)
 
 
 @router.get('/all-request-statuses', summary="Получение всех статусов заявок")
-async def get_all_request_statuses(db: db_dependency):
+async def get_all_request_statuses(db: read_db_dependency):
     query = select(RequestStatus)
     result = await db.execute(query)
     request_statuses = result.scalars().all()
@@ -339,32 +348,27 @@ async def add_user_to_project(
             detail="Пользователь не найден"
         )
 
-    existing_relation_query = select(ProjectUser).where(
-        ProjectUser.project_id == data.project_id,
-        ProjectUser.user_id == data.user_id
-    )
-    existing_relation_result = await db.execute(existing_relation_query)
-    existing_relation = existing_relation_result.scalar_one_or_none()
-
-    if existing_relation is not None:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Пользователь уже добавлен в проект"
-        )
-
+    # Повторное добавление отсекает уникальное ограничение (project_id, user_id)
     project_user = ProjectUser(
         project_id=data.project_id,
         user_id=data.user_id
     )
     db.add(project_user)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Пользователь уже добавлен в проект"
+        )
     await db.refresh(project_user)
 
     return {"message": "Пользователь успешно добавлен в проект"}
 
 
 @router.get('/all-projects', summary="Получение всех проектов")
-async def get_all_projects(db: db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
+async def get_all_projects(db: read_db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
     offset = page * per_page
     query = select(Project).offset(offset).limit(per_page)
     result = await db.execute(query)
@@ -392,7 +396,7 @@ async def get_all_projects(db: db_dependency, current_user: dict = Depends(get_c
     }
 
 @router.get('/all-requests', summary="Получение всех заявок")
-async def get_all_requests(db: db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
+async def get_all_requests(db: read_db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
     offset = page * per_page
     query = select(Request).offset(offset).limit(per_page)
     result = await db.execute(query)
@@ -412,7 +416,7 @@ async def get_all_requests(db: db_dependency, current_user: dict = Depends(get_c
     }
 
 @router.get('/all-chats-participants', summary="Получение всех участников чатов")
-async def get_all_chats_participants(db: db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
+async def get_all_chats_participants(db: read_db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
     offset = page * per_page
     query = select(ChatParticipant).offset(offset).limit(per_page)
     result = await db.execute(query)
@@ -431,7 +435,7 @@ async def get_all_chats_participants(db: db_dependency, current_user: dict = Dep
     }
 
 @router.get('/all-chats', summary="Получение всех чатов")
-async def get_all_chats_participants(db: db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
+async def get_all_chats_participants(db: read_db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
     offset = page * per_page
     query = select(Chat).offset(offset).limit(per_page)
     result = await db.execute(query)
@@ -451,7 +455,7 @@ async def get_all_chats_participants(db: db_dependency, current_user: dict = Dep
 
 
 @router.get('/all-users', summary="Получение всех пользователей")
-async def get_all_users(db: db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
+async def get_all_users(db: read_db_dependency, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"])), page: int = Query(0, ge=0, description="Номер страницы"), per_page: int = Query(10, ge=1, le=100, description="Количество элементов на странице")):
     offset = page * per_page
 
     query = select(User).offset(offset).limit(per_page)
@@ -483,6 +487,11 @@ async def get_all_users(db: db_dependency, current_user: dict = Depends(get_curr
     }
 
 
+@router.get('/slow-queries', summary="Последние медленные SQL-запросы воркера")
+async def get_slow_queries(current_user: dict = Depends(get_current_user_with_roles(["ADMIN"])), limit: int = Query(50, ge=1, le=500, description="Количество записей")):
+    return {"data": slow_query_log.latest(limit)}
+
+
 @router.delete('/delete-user', summary="Удаление пользователя по id")
 async def delete_user(db: db_dependency, data: DeleteRoleRequest, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"]))):
     query = select(User).where(User.id == data.id)
@@ -493,8 +502,10 @@ async def delete_user(db: db_dependency, data: DeleteRoleRequest, current_user:
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Пользователя с таким id нет в базе данных"
         )
+    email, user_id = role.email, role.id
     await db.delete(role)
     await db.commit()
+    await invalidate_principal(email, user_id)
 
 @router.delete('/delete-task', summary="Удаление задачи по id")
 async def delete_task(db: db_dependency, data: DeleteRoleRequest, current_user: dict = Depends(get_current_user_with_roles(["ADMIN", "MODERATOR"]))):
@@ -506,8 +517,10 @@ async def delete_task(db: db_dependency, data: DeleteRoleRequest, current_user:
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Задачи с таким id нет в базе данных"
         )
+    project_id = task.project_id
     await db.delete(task)
     await db.commit()
+    await publish_project_event(project_id, "task.deleted", {"task_id": data.id})
 
 
 @router.delete('/delete-project', summary="Удаление проекта по id")
@@ -572,17 +585,16 @@ async def create_task(
         raise HTTPException(status_code=404, detail="Проект не найден")
 
     # Проверка: существует ли статус
-    status_result = await db.execute(select(TaskStatus).where(TaskStatus.id == request.status_id))
-    status_obj = status_result.scalar_one_or_none()
-    if not status_obj:
+    if task_statuses.get(request.status_id) is None:
         raise HTTPException(status_code=404, detail="Статус задачи не найден")
 
     # Проверка: существует ли приоритет
-    priority_result = await db.execute(select(TaskPriority).where(TaskPriority.id == request.priority_id))
-    priority_obj = priority_result.scalar_one_or_none()
-    if not priority_obj:
+    if task_priorities.get(request.priority_id) is None:
         raise HTTPException(status_code=404, detail="Приоритет задачи не найден")
 
+    # Проверка: существуют ли исполнители, до создания задачи
+    assignee_ids = await validate_assignees(db, request.assignee_ids or [])
+
     deadline = request.deadline.astimezone(timezone.utc).replace(tzinfo=None)
     # Создаём задачу
     new_task = Task(
@@ -591,25 +603,16 @@ async def create_task(
         project_id=request.project_id,
         status_id=request.status_id,
         priority_id=request.priority_id,
-        deadline=deadline
+        deadline=deadline,
+        rank=await rank_at_end(db, request.project_id, request.status_id)
     )
     db.add(new_task)
-    await db.commit()
-    await db.refresh(new_task)
+    await db.flush()
 
     # Назначаем исполнителей
-    for user_id in request.assignee_ids:
-        user_result = await db.execute(select(User).where(User.id == user_id))
-        user = user_result.scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail=f"Пользователь {user_id} не найден")
-
-        task_assignment = TaskAssignment(
-            task_id=new_task.id,
-            user_id=user_id
-        )
-        db.add(task_assignment)
+    db.add_all([TaskAssignment(task_id=new_task.id, user_id=user_id) for user_id in assignee_ids])
 
     await db.commit()
+    await publish_task_created(db, new_task)
 
     return {"detail": "Задача успешно создана", "task_id": new_task.id}
@@ -4,25 +4,35 @@ from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from pydantic import BaseModel
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from uuid import UUID, uuid4
 
+import settings
+from broadcast import broadcast, record_publish_failure
+from cache import TTLCache
 from database import db_dependency
 from models import User, Role
+from reference_data import roles
 from settings import JWT_SECRET_KEY, ALGORITHM
-from utils import verify_password, create_refresh_token, create_access_token
+from utils import verify_password_async, get_hashed_password_async, create_refresh_token, create_access_token
 
 router = APIRouter(
     prefix='/auth',
     tags=['auth']
 )
 
-bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
 
+PRINCIPAL_INVALIDATIONS_TOPIC = "principal_invalidations"
+
+# Пользователь с ролью по subject токена (email), чтобы не ходить в базу на каждый запрос
+principal_cache = TTLCache("principal", settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL)
+# Версия токенов пользователя по id для режима STATELESS_AUTH
+token_version_cache = TTLCache("token_version", settings.PRINCIPAL_CACHE_SIZE, settings.TOKEN_VERSION_CACHE_TTL)
+
 class CreateUserRequest(BaseModel):
     first_name: str
     last_name: str
@@ -49,6 +59,23 @@ class CurrentUser(BaseModel):
     role: str
     avatar: Optional[str] = None
 
+async def create_user_access_token(db: AsyncSession, user: User) -> str:
+    if not settings.STATELESS_AUTH:
+        return create_access_token(user.email)
+    role = roles.get(user.role_id)
+    if role is None:
+        return create_access_token(user.email)
+    # Всё, что нужно зависимостям авторизации, передаётся в самом токене
+    return create_access_token(user.email, claims={
+        "uid": str(user.id),
+        "role_id": str(user.role_id),
+        "role": role.title,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "avatar": user.avatar,
+        "ver": user.token_version,
+    })
+
 @router.post('/signup', summary="Создание нового пользователя")
 async def create_user(db: db_dependency, first_name: str = Form(...), last_name: str = Form(...), email: str = Form(...), password: str = Form(...), role_id: UUID = Form(...),  avatar: Optional[UploadFile] = File(None)):
     query = select(User).where(User.email == email)
@@ -59,6 +86,8 @@ async def create_user(db: db_dependency, first_name: str = Form(...), last_name:
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Пользователь с указанным email уже есть в базе данных"
         )
+    # Соединение возвращается в пул на время хеширования, см. login
+    await db.commit()
 
     avatar_path = None
     if avatar:
@@ -75,7 +104,7 @@ async def create_user(db: db_dependency, first_name: str = Form(...), last_name:
         first_name=first_name,
         last_name=last_name,
         email=email,
-        password=bcrypt_context.hash(password),
+        password=await get_hashed_password_async(password),
         role_id=role_id,
         avatar = avatar_path
     )
@@ -94,16 +123,19 @@ async def login(db: db_dependency, form_data: OAuth2PasswordRequestForm = Depend
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Некорректный email или пароль"
         )
+    # Ожидание bcrypt не должно держать соединение из пула: при шторме логинов остальные запросы
+    # остались бы без соединений. Атрибуты user после коммита не сбрасываются (expire_on_commit=False)
+    await db.commit()
 
     hashed_pass = user.password
-    if not verify_password(form_data.password, hashed_pass):
+    if not await verify_password_async(form_data.password, hashed_pass):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Некорректный email или пароль"
         )
 
     return {
-        "access_token": create_access_token(user.email),
+        "access_token": await create_user_access_token(db, user),
         "refresh_token": create_refresh_token(user.email),
         "token_type": "bearer",
     }
@@ -140,7 +172,7 @@ async def refresh_token(data: RefreshTokenRequest, db: db_dependency):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    new_access_token = create_access_token(user.email)
+    new_access_token = await create_user_access_token(db, user)
     return {
         "access_token": new_access_token,
         "refresh_token": data.refresh_token,
@@ -150,7 +182,8 @@ async def refresh_token(data: RefreshTokenRequest, db: db_dependency):
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-async def get_current_user(db: db_dependency, token: str = Depends(oauth2_scheme)):
+async def authenticate_token(db: AsyncSession, token: str) -> CurrentUser:
+    # Общая проверка токена для HTTP-зависимостей и WebSocket-соединений
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -167,6 +200,13 @@ async def get_current_user(db: db_dependency, token: str = Depends(oauth2_scheme
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    if settings.STATELESS_AUTH and "uid" in payload:
+        return await authenticate_claims(db, email, payload)
+
+    current_user = principal_cache.get(email)
+    if current_user is not None:
+        return current_user
+
     query = select(User.id, User.email, User.first_name, User.last_name, User.role_id, Role.title.label("role"), User.avatar) \
         .join(Role, User.role_id == Role.id) \
         .where(User.email == email)
@@ -179,15 +219,73 @@ async def get_current_user(db: db_dependency, token: str = Depends(oauth2_scheme
             detail="Пользователь не найден",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return CurrentUser(**user._asdict())
+    current_user = CurrentUser(**user._asdict())
+    principal_cache.set(email, current_user)
+    return current_user
+
+async def authenticate_claims(db: AsyncSession, email: str, payload: dict) -> CurrentUser:
+    # Пользователь берётся из claims токена; база нужна только для версии при промахе кэша
+    user_id = payload["uid"]
+    token_version = token_version_cache.get(user_id)
+    if token_version is None:
+        version_query = select(User.token_version).where(User.id == user_id)
+        version_result = await db.execute(version_query)
+        token_version = version_result.scalar_one_or_none()
+        if token_version is not None:
+            token_version_cache.set(user_id, token_version)
+    if token_version is None or token_version != payload.get("ver"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Токен отозван",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return CurrentUser(
+        id=user_id,
+        email=email,
+        first_name=payload["first_name"],
+        last_name=payload["last_name"],
+        role_id=payload["role_id"],
+        role=payload["role"],
+        avatar=payload.get("avatar"),
+    )
+
+async def invalidate_principal(email: Optional[str] = None, user_id: Optional[UUID] = None):
+    # Без email и user_id сбрасываются кэши целиком, например после удаления роли
+    message = {"email": email, "user_id": str(user_id) if user_id else None}
+    if settings.PRINCIPAL_CACHE_BROADCAST:
+        try:
+            await broadcast.publish(PRINCIPAL_INVALIDATIONS_TOPIC, message)
+            return
+        except Exception as e:
+            # Остальные воркеры увидят изменение по истечении TTL кэша
+            record_publish_failure(PRINCIPAL_INVALIDATIONS_TOPIC, e)
+    await apply_principal_invalidation(message)
+
+async def apply_principal_invalidation(message: dict):
+    if message.get("email") is None and message.get("user_id") is None:
+        principal_cache.clear()
+        token_version_cache.clear()
+        return
+    if message.get("email") is not None:
+        principal_cache.pop(message["email"])
+    if message.get("user_id") is not None:
+        token_version_cache.pop(message["user_id"])
+
+broadcast.subscribe(PRINCIPAL_INVALIDATIONS_TOPIC, apply_principal_invalidation)
+
+async def get_current_user(db: db_dependency, token: str = Depends(oauth2_scheme)):
+    return await authenticate_token(db, token)
+
+def ensure_role(current_user, allowed_roles: list):
+    if current_user.role not in allowed_roles:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"У вас нет прав доступа. Разрешенные роли: {', '.join(allowed_roles)}",
+        )
 
 def get_current_user_with_roles(allowed_roles: list):
     async def dependency(current_user: dict = Depends(get_current_user)):
-        if current_user.role not in allowed_roles:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"У вас нет прав доступа. Разрешенные роли: {', '.join(allowed_roles)}",
-            )
+        ensure_role(current_user, allowed_roles)
         return current_user
 
     return dependency
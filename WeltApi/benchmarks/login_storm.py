@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Задержка /chats/my-chats без нагрузки и во время шторма логинов на запущенном сервере.
+# Пароли проверяются в пуле потоков, поэтому p99 чатов во время шторма должен оставаться близким к исходному,
+# а лишние логины - получать 503, а не ждать в очереди.
+#
+#   uvicorn main:app --workers 1
+#   python benchmarks/login_storm.py --url http://localhost:8000 --email user@example.com --password secret
+#
+# Один воркер uvicorn делает результат воспроизводимым: все запросы проходят через один event loop.
+# Хеширование занимает PASSWORD_HASH_WORKERS ядер, поэтому ядер у сервера должно быть больше,
+# а клиент лучше запускать на другой машине: иначе его потоки отнимают процессор у сервера.
+# Без пакета bcrypt passlib берёт бэкенд os_crypt, который держит GIL, и event loop стоит на каждом логине.
+
+
+def request(url: str, data: dict = None, headers: dict = None, timeout: float = 30.0):
+    body = urllib.parse.urlencode(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def login(base_url: str, email: str, password: str):
+    return request(f"{base_url}/auth/login", data={"username": email, "password": password})
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def probe_chats(base_url: str, headers: dict, duration: float, concurrency: int):
+    # Несколько клиентов без пауз запрашивают список чатов, задержка каждого ответа в миллисекундах
+    latencies = []
+    errors = Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def run():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            status, _ = request(f"{base_url}/chats/my-chats?limit=20", headers=headers)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors[status] += 1
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(run)
+    return latencies, errors
+
+
+def storm_logins(base_url: str, email: str, password: str, stop: threading.Event, concurrency: int):
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def run():
+        while not stop.is_set():
+            status, _ = login(base_url, email, password)
+            with lock:
+                statuses[status] += 1
+
+    executor = ThreadPoolExecutor(concurrency)
+    for _ in range(concurrency):
+        executor.submit(run)
+    return executor, statuses
+
+
+def report(name: str, latencies, errors):
+    if not latencies:
+        print(f"{name:>12}: нет успешных ответов, ошибки: {dict(errors)}")
+        return
+    print(
+        f"{name:>12}: запросов {len(latencies):>6}  p50 {statistics.median(latencies):7.1f} мс  "
+        f"p99 {percentile(latencies, 0.99):7.1f} мс  max {max(latencies):7.1f} мс  ошибки: {dict(errors)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="p99 /chats/my-chats во время шторма логинов")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True, help="существующий пользователь")
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--duration", type=float, default=15.0, help="секунд на каждый замер")
+    parser.add_argument("--probes", type=int, default=4, help="параллельных клиентов списка чатов")
+    parser.add_argument("--logins", type=int, default=64, help="параллельных клиентов логина")
+    args = parser.parse_args()
+    base_url = args.url.rstrip("/")
+
+    status, body = login(base_url, args.email, args.password)
+    if status != 200:
+        raise SystemExit(f"Не удалось войти: {status} {body.decode(errors='replace')}")
+    headers = {"Authorization": f"Bearer {json.loads(body)['access_token']}"}
+
+    # Прогрев: соединения с базой и кэш пользователя
+    probe_chats(base_url, headers, 1.0, args.probes)
+
+    baseline, baseline_errors = probe_chats(base_url, headers, args.duration, args.probes)
+
+    stop = threading.Event()
+    executor, login_statuses = storm_logins(base_url, args.email, args.password, stop, args.logins)
+    try:
+        storm, storm_errors = probe_chats(base_url, headers, args.duration, args.probes)
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+    print(f"ядер на машине клиента: {os.cpu_count()}")
+    report("без нагрузки", baseline, baseline_errors)
+    report("шторм", storm, storm_errors)
+    print(f"логины во время шторма: {dict(login_statuses)}")
+    if baseline and storm:
+        print(f"рост p99: {percentile(storm, 0.99) / percentile(baseline, 0.99):.2f}x")
+
+
+if __name__ == "__main__":
+    main()
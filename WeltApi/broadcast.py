@@ -0,0 +1,163 @@
+import abc
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+import settings
+from logsHandle import logger
+from metrics import Counter
+
+Handler = Callable[[dict], Awaitable[None]]
+
+# Postgres ограничивает payload NOTIFY 8000 байтами
+NOTIFY_PAYLOAD_LIMIT = 7900
+RECONNECT_DELAY_SECONDS = 1.0
+
+
+class PayloadTooLarge(ValueError):
+    pass
+
+
+def record_publish_failure(topic: str, error: Exception):
+    # Ошибка публикации после коммита не должна превращаться в 500: клиент повторит запрос
+    # и создаст дубликат. Пропущенное событие покрывается TTL кэшей или дозапросом по seq
+    logger.error(f"Error publishing broadcast message for topic {topic}: {error}")
+    broadcast_publish_failures.inc(topic=topic)
+
+
+class BroadcastBackend(abc.ABC):
+    # Публикация происходит один раз, а каждый воркер получает сообщение
+    # и доставляет его своим локальным подписчикам через обработчики топика
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+
+    def subscribe(self, topic: str, handler: Handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    @abc.abstractmethod
+    async def publish(self, topic: str, message: dict):
+        pass
+
+    async def dispatch(self, topic: str, message: dict):
+        for handler in self._handlers.get(topic, []):
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error(f"Error handling broadcast message for topic {topic}: {e}")
+
+
+class MemoryBroadcast(BroadcastBackend):
+    async def publish(self, topic: str, message: dict):
+        await self.dispatch(topic, message)
+
+
+class PostgresBroadcast(BroadcastBackend):
+    def __init__(self, dsn: str, channel: str):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self._connection: Optional[asyncpg.Connection] = None
+        # Одно соединение asyncpg не допускает параллельных запросов
+        self._lock = asyncio.Lock()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._consumer: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def connect(self):
+        self._closing = False
+        await self._open_connection()
+        if self._consumer is None:
+            self._consumer = asyncio.create_task(self._consume())
+
+    async def disconnect(self):
+        self._closing = True
+        for task in (self._reconnect_task, self._consumer):
+            if task is not None:
+                task.cancel()
+        self._reconnect_task = None
+        self._consumer = None
+        if self._is_connected():
+            await self._connection.close()
+        self._connection = None
+
+    async def publish(self, topic: str, message: dict):
+        payload = json.dumps({"topic": topic, "message": message})
+        if len(payload.encode()) > NOTIFY_PAYLOAD_LIMIT:
+            raise PayloadTooLarge(f"Broadcast payload for topic {topic} exceeds {NOTIFY_PAYLOAD_LIMIT} bytes")
+        async with self._lock:
+            if not self._is_connected():
+                # Соединение открывает только задача переподключения: второе открытие оставило бы
+                # лишний LISTEN, и каждое событие доставлялось бы дважды
+                self._schedule_reconnect()
+                raise ConnectionError("Broadcast connection is not available")
+            await self._connection.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+    def _is_connected(self) -> bool:
+        return self._connection is not None and not self._connection.is_closed()
+
+    async def _open_connection(self):
+        connection = await asyncpg.connect(self.dsn)
+        await connection.add_listener(self.channel, self._on_notification)
+        connection.add_termination_listener(self._on_termination)
+        self._connection = connection
+        logger.info(f"Listening for broadcast on Postgres channel {self.channel}")
+
+    def _on_notification(self, connection, pid, channel, payload):
+        # Доставка идёт через очередь с одним потребителем, чтобы сохранить порядок событий
+        self._queue.put_nowait(payload)
+
+    def _on_termination(self, connection):
+        if self._closing:
+            return
+        logger.warning("Broadcast listener connection lost, reconnecting")
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if self._closing:
+            return
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._closing:
+            try:
+                async with self._lock:
+                    if not self._is_connected():
+                        await self._open_connection()
+                return
+            except Exception as e:
+                logger.error(f"Broadcast reconnect failed: {e}")
+                await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+
+    async def _consume(self):
+        while True:
+            payload = await self._queue.get()
+            try:
+                data = json.loads(payload)
+            except ValueError:
+                logger.error("Received malformed broadcast payload")
+                continue
+            await self.dispatch(data["topic"], data["message"])
+
+
+def create_broadcast() -> BroadcastBackend:
+    if settings.BROADCAST_BACKEND == "postgres":
+        dsn = settings.REAL_DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+        return PostgresBroadcast(dsn, settings.BROADCAST_CHANNEL)
+    return MemoryBroadcast()
+
+
+broadcast = create_broadcast()
+
+broadcast_publish_failures = Counter(
+    "welt_broadcast_publish_failures_total", "Broadcast messages that failed to publish", ("topic",)
+)
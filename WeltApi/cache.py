@@ -0,0 +1,42 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from metrics import Counter, Gauge
+
+
+class TTLCache:
+    # Кэш в памяти воркера: не больше maxsize записей (вытесняются давно не читанные),
+    # каждая живёт ttl секунд. Попадания и промахи видны в /metrics
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = Counter(f"welt_{name}_cache_hits_total", f"Hits of the {name} cache")
+        self.misses = Counter(f"welt_{name}_cache_misses_total", f"Misses of the {name} cache")
+        Gauge(f"welt_{name}_cache_entries", f"Entries in the {name} cache", function=lambda: len(self.entries))
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses.inc()
+            return None
+        self.entries.move_to_end(key)
+        self.hits.inc()
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
@@ -1,78 +1,147 @@
+from collections import defaultdict
 from datetime import datetime
 from typing import Optional, List
-from uuid import UUID
+from uuid import UUID, uuid4
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
-from sqlalchemy import select, true, exists, and_, or_, func
+from sqlalchemy import select, exists, and_, or_, func, tuple_, update, text, case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased
 from starlette import status
 
 from auth import get_current_user
-from database import db_dependency
-from models import Chat, ChatParticipant, Message, User
-from my_websockets import notify_clients_about_new_message, notify_clients_about_message_deletion
+from database import db_dependency, read_db_dependency
+from models import Chat, ChatParticipant, ChatRemoval, Message, User
+from my_websockets import publish_chat_event, serialize_message
+from read_receipts import read_receipts
 from settings import BASE_URL
+from utils import encode_cursor, decode_cursor
 
 router = APIRouter(
     prefix='/chats',
     tags=['chats']
 )
 
-
-@router.get('/my-chats', summary="Получение всех чатов пользователя")
-async def get_my_chats(db: db_dependency, search_query: str = "", current_user: dict = Depends(get_current_user)):
-    current_user_id = current_user.id
-
-    subquery_last_message = (
-        select(
-            Message.chat_id,
-            Message.text.label("last_message_text"),
-            Message.sent_at.label("last_message_time"),
-            Message.sender_id.label("last_message_sender_id")
+MESSAGES_PAGE_MAX_LIMIT = 200
+CHATS_PAGE_MAX_LIMIT = 100
+LAST_MESSAGE_PREVIEW_LENGTH = 200
+SEARCH_PAGE_MAX_LIMIT = 50
+# Должна совпадать с конфигурацией в триггере messages_search_vector_update
+SEARCH_TS_CONFIG = "russian"
+SEARCH_HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5"
+SYNC_PAGE_MAX_LIMIT = 1000
+# Общий счётчик изменений сообщений, чатов и участников (триггер sync_change_id_update)
+SYNC_SEQUENCE = "sync_change_id_seq"
+# Смещение ключей advisory-блокировок из sync_change_id_next (миграция e4b9d2a7c1f3)
+SYNC_GUARD_LOCK_OFFSET = 1 << 62
+SYNC_GUARD_QUERY = text(
+    """
+    SELECT min(((classid::text::bigint << 32) | objid::text::bigint) - :offset)
+    FROM pg_locks
+    WHERE locktype = 'advisory'
+      AND objsubid = 1
+      AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND classid::text::bigint >= (:offset >> 32)
+    """
+).bindparams(offset=SYNC_GUARD_LOCK_OFFSET)
+
+
+async def get_users_without_chats(db: AsyncSession, current_user_id: UUID, search_query: str):
+    private_chats_subquery = (
+        select(Chat.id)
+        .join(ChatParticipant, Chat.id == ChatParticipant.chat_id)
+        .where(Chat.is_group_chat == False)
+        .group_by(Chat.id)
+        .having(
+            and_(
+                func.count(ChatParticipant.user_id) == 2,
+                func.bool_or(ChatParticipant.user_id == current_user_id)
+            )
         )
-        .where(Message.chat_id == Chat.id)
-        .order_by(Message.sent_at.desc())
-        .limit(1)
-        .lateral("last_message")
     )
 
-    query = (
-        select(
-            Chat.id,
-            Chat.name,
-            Chat.is_group_chat,
-            ChatParticipant.user_id,
-            subquery_last_message.c.last_message_text,
-            subquery_last_message.c.last_message_time,
-            subquery_last_message.c.last_message_sender_id
-        )
-        .join(ChatParticipant, Chat.id == ChatParticipant.chat_id)
-        .outerjoin(subquery_last_message, true())
+    users_without_chats_query = (
+        select(User.id, User.first_name, User.last_name, User.avatar)
         .where(
-            and_(
-                ChatParticipant.user_id == current_user_id,
-                Chat.request_id.is_(None)
+            User.id != current_user_id,
+            ~exists(
+                select(ChatParticipant)
+                .where(
+                    ChatParticipant.chat_id.in_(private_chats_subquery),
+                    ChatParticipant.user_id == User.id
+                )
             )
         )
     )
 
-    result = await db.execute(query)
-    chats = result.fetchall()
+    if search_query:
+        users_without_chats_query = users_without_chats_query.where(
+            or_(
+                User.first_name.ilike(f"%{search_query}%"),
+                User.last_name.ilike(f"%{search_query}%")
+            )
+        )
 
-    formatted_chats = []
+    users_without_chats_result = await db.execute(users_without_chats_query)
+    users_without_chats = users_without_chats_result.fetchall()
+
+    return [
+        {
+            "id": user.id,
+            "name": f"{user.first_name} {user.last_name}",
+            "icons": f"{BASE_URL}/{user.avatar}" if user.avatar else None,
+            "has_chat": False,
+        }
+        for user in users_without_chats
+    ]
+
+
+def parse_chat_cursor(cursor: str):
+    try:
+        last_message_at, chat_id = decode_cursor(cursor)
+        return (datetime.fromisoformat(last_message_at) if last_message_at else None), UUID(chat_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный курсор"
+        )
+
+
+def chats_after_cursor(last_message_at: Optional[datetime], chat_id: UUID):
+    # Порядок: last_message_at DESC NULLS LAST, chat_id DESC (индекс ix_chat_participants_user_id_last_message_at)
+    if last_message_at is None:
+        return and_(ChatParticipant.last_message_at.is_(None), ChatParticipant.chat_id < chat_id)
+    return or_(
+        ChatParticipant.last_message_at < last_message_at,
+        and_(ChatParticipant.last_message_at == last_message_at, ChatParticipant.chat_id < chat_id),
+        ChatParticipant.last_message_at.is_(None)
+    )
 
-    for chat in chats:
-        chat_id = chat.id
-        is_group_chat = chat.is_group_chat
 
+async def format_chats(db: AsyncSession, chats, current_user):
+    current_user_id = current_user.id
+
+    # Участники всех найденных чатов загружаются одним запросом
+    participants_by_chat = defaultdict(list)
+    chat_ids = [chat.id for chat in chats]
+    if chat_ids:
         participants_query = (
-            select(User.id, User.first_name, User.last_name, User.avatar)
-            .join(ChatParticipant, User.id == ChatParticipant.user_id)
-            .where(ChatParticipant.chat_id == chat_id)
+            select(ChatParticipant.chat_id, User.id, User.first_name, User.last_name, User.avatar)
+            .join(User, User.id == ChatParticipant.user_id)
+            .where(ChatParticipant.chat_id.in_(chat_ids))
         )
         participants_result = await db.execute(participants_query)
-        participants = participants_result.fetchall()
+        for participant in participants_result.fetchall():
+            participants_by_chat[participant.chat_id].append(participant)
+
+    formatted_chats = []
+
+    for chat in chats:
+        chat_id = chat.id
+        is_group_chat = chat.is_group_chat
+        participants = participants_by_chat[chat_id]
 
         if is_group_chat:
             chat_name = chat.name
@@ -92,9 +161,9 @@ async def get_my_chats(db: db_dependency, search_query: str = "", current_user:
 
         last_message = {
             "text": chat.last_message_text,
-            "sent_at": chat.last_message_time,
+            "sent_at": chat.last_message_at,
             "sender_id": chat.last_message_sender_id,
-        } if chat.last_message_text else None
+        } if chat.last_message_at else None
 
         formatted_chats.append({
             "id": chat_id,
@@ -102,75 +171,137 @@ async def get_my_chats(db: db_dependency, search_query: str = "", current_user:
             "is_group_chat": is_group_chat,
             "icons": chat_icons,
             "last_message": last_message,
+            "unread_count": chat.unread_count,
         })
 
-    if search_query:
-        formatted_chats = [
-            chat for chat in formatted_chats
-            if search_query.lower() in chat["name"].lower()
-        ]
+    return formatted_chats
 
-    private_chats_subquery = (
-        select(Chat.id)
+
+@router.get('/my-chats', summary="Получение всех чатов пользователя")
+async def get_my_chats(
+    db: read_db_dependency,
+    search_query: str = "",
+    current_user: dict = Depends(get_current_user),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы"),
+    limit: Optional[int] = Query(None, ge=1, le=CHATS_PAGE_MAX_LIMIT, description="Количество чатов на странице")
+):
+    current_user_id = current_user.id
+
+    query = (
+        select(
+            Chat.id,
+            Chat.name,
+            Chat.is_group_chat,
+            Chat.last_message_text,
+            ChatParticipant.last_message_at,
+            Chat.last_message_sender_id,
+            ChatParticipant.unread_count
+        )
         .join(ChatParticipant, Chat.id == ChatParticipant.chat_id)
-        .where(Chat.is_group_chat == False)
-        .group_by(Chat.id)
-        .having(
+        .where(
             and_(
-                func.count(ChatParticipant.user_id) == 2,
-                func.bool_or(ChatParticipant.user_id == current_user_id)
+                ChatParticipant.user_id == current_user_id,
+                Chat.request_id.is_(None)
             )
         )
+        .order_by(ChatParticipant.last_message_at.desc().nulls_last(), ChatParticipant.chat_id.desc())
     )
 
-    users_without_chats_query = (
-        select(User.id, User.first_name, User.last_name, User.avatar)
-        .where(
-            User.id != current_user_id,
-            ~exists(
-                select(ChatParticipant)
-                .where(
-                    ChatParticipant.chat_id.in_(private_chats_subquery),
-                    ChatParticipant.user_id == User.id
-                )
-            )
-        )
-    )
+    if cursor:
+        query = query.where(chats_after_cursor(*parse_chat_cursor(cursor)))
 
     if search_query:
-        users_without_chats_query = users_without_chats_query.where(
-            or_(
-                User.first_name.ilike(f"%{search_query}%"),
-                User.last_name.ilike(f"%{search_query}%")
+        # Название приватного чата - имя собеседника, поэтому ищем по участникам прямо в SQL
+        pattern = f"%{search_query}%"
+        participant_alias = aliased(ChatParticipant)
+        other_participant_exists = (
+            select(participant_alias.id)
+            .where(
+                participant_alias.chat_id == Chat.id,
+                participant_alias.user_id != current_user_id
             )
         )
+        name_conditions = [
+            and_(Chat.is_group_chat.is_(True), Chat.name.ilike(pattern)),
+            and_(
+                Chat.is_group_chat.is_not(True),
+                exists(
+                    other_participant_exists
+                    .join(User, User.id == participant_alias.user_id)
+                    .where(func.concat(User.first_name, ' ', User.last_name).ilike(pattern))
+                )
+            ),
+        ]
+        if search_query.lower() in f"{current_user.first_name} {current_user.last_name}".lower():
+            # Чат с самим собой называется именем текущего пользователя
+            name_conditions.append(
+                and_(Chat.is_group_chat.is_not(True), ~exists(other_participant_exists))
+            )
+        query = query.where(or_(*name_conditions))
 
-    users_without_chats_result = await db.execute(users_without_chats_query)
-    users_without_chats = users_without_chats_result.fetchall()
+    if limit is not None:
+        query = query.limit(limit + 1)
 
-    formatted_users_without_chats = [
-        {
-            "id": user.id,
-            "name": f"{user.first_name} {user.last_name}",
-            "icons": f"{BASE_URL}/{user.avatar}" if user.avatar else None,
-            "has_chat": False,
-        }
-        for user in users_without_chats
-    ]
+    result = await db.execute(query)
+    chats = result.fetchall()
+
+    next_cursor = None
+    if limit is not None and len(chats) > limit:
+        chats = chats[:limit]
+        next_cursor = encode_cursor(chats[-1].last_message_at, chats[-1].id)
+
+    formatted_chats = await format_chats(db, chats, current_user)
+
+    # Пользователи без чатов нужны только на первой странице
+    formatted_users_without_chats = []
+    if cursor is None:
+        formatted_users_without_chats = await get_users_without_chats(db, current_user_id, search_query)
 
     return {
         "chats": formatted_chats,
         "users_without_chats": formatted_users_without_chats,
+        "next_cursor": next_cursor,
     }
 
-@router.get('/chat-messages/{chat_id}', summary="Получение всех сообщений чата")
+async def next_chat_seq(db: AsyncSession, chat_id: UUID) -> int:
+    # Блокировка строки чата до конца транзакции делает номера событий монотонными
+    result = await db.execute(
+        update(Chat)
+        .where(Chat.id == chat_id)
+        .values(event_seq=Chat.event_seq + 1)
+        .returning(Chat.event_seq)
+    )
+    return result.scalar_one()
+
+
+def parse_message_cursor(cursor: str):
+    try:
+        sent_at, message_id = decode_cursor(cursor)
+        return datetime.fromisoformat(sent_at), UUID(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный курсор"
+        )
+
+
+@router.get('/chat-messages/{chat_id}', summary="Получение сообщений чата (keyset-пагинация)")
 async def get_chat_messages(
     chat_id: UUID,
     db: db_dependency,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    before: Optional[str] = Query(None, description="Курсор: сообщения старше указанного"),
+    after: Optional[str] = Query(None, description="Курсор: сообщения новее указанного"),
+    limit: int = Query(50, ge=1, le=MESSAGES_PAGE_MAX_LIMIT, description="Количество сообщений на странице")
 ):
     current_user_id = current_user.id
 
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Нельзя одновременно указывать before и after"
+        )
+
     chat_query = select(Chat).where(Chat.id == chat_id)
     chat_result = await db.execute(chat_query)
     chat = chat_result.scalar_one_or_none()
@@ -180,54 +311,63 @@ async def get_chat_messages(
             detail="Чат не найден"
         )
 
-    participant_query = select(ChatParticipant).where(
-        ChatParticipant.chat_id == chat_id,
-        ChatParticipant.user_id == current_user_id
+    participants_query = (
+        select(User.id, User.first_name, User.last_name)
+        .join(ChatParticipant, User.id == ChatParticipant.user_id)
+        .where(ChatParticipant.chat_id == chat_id)
     )
-    participant_result = await db.execute(participant_query)
-    participant = participant_result.scalar_one_or_none()
-    if not participant:
+    participants_result = await db.execute(participants_query)
+    participants = participants_result.fetchall()
+
+    if not any(p.id == current_user_id for p in participants):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Вы не являетесь участником этого чата"
         )
 
-    messages_query = (
-        select(Message)
-        .where(Message.chat_id == chat_id)
-        .order_by(Message.sent_at.asc())
-    )
-    messages_result = await db.execute(messages_query)
+    # Ключ сортировки (sent_at, id) покрыт индексом ix_messages_chat_id_sent_at_id
+    sort_key = tuple_(Message.sent_at, Message.id)
+    messages_query = select(Message).where(Message.chat_id == chat_id, Message.deleted_at.is_(None))
+    if after:
+        messages_query = (
+            messages_query
+            .where(sort_key > tuple_(*parse_message_cursor(after)))
+            .order_by(Message.sent_at.asc(), Message.id.asc())
+        )
+    else:
+        if before:
+            messages_query = messages_query.where(sort_key < tuple_(*parse_message_cursor(before)))
+        messages_query = messages_query.order_by(Message.sent_at.desc(), Message.id.desc())
+
+    # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+    messages_result = await db.execute(messages_query.limit(limit + 1))
     messages = messages_result.scalars().all()
 
-    participants_query = (
-        select(User.id, User.first_name, User.last_name)
-        .join(ChatParticipant, User.id == ChatParticipant.user_id)
-        .where(ChatParticipant.chat_id == chat_id)
-    )
-    participants_result = await db.execute(participants_query)
-    participants = participants_result.fetchall()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not after:
+        messages.reverse()
+
+    next_cursor = None
+    if has_more and messages:
+        boundary = messages[-1] if after else messages[0]
+        next_cursor = encode_cursor(boundary.sent_at, boundary.id)
 
     if chat.is_group_chat:
         chat_name = chat.name
     else:
         other_participants = [p for p in participants if p.id != current_user_id]
         if len(other_participants) == 0:
-            chat_name = f"{current_user['first_name']} {current_user['last_name']}"
+            chat_name = f"{current_user.first_name} {current_user.last_name}"
         else:
             other_participant = other_participants[0]
             chat_name = f"{other_participant.first_name} {other_participant.last_name}"
 
+    sender_names = {p.id: f"{p.first_name} {p.last_name}" for p in participants}
+
     formatted_messages = [
         {
-            "id": message.id,
-            "text": message.text,
-            "sent_at": message.sent_at,
-            "sender_id": message.sender_id,
-            "sender_name": next(
-                (f"{p.first_name} {p.last_name}" for p in participants if p.id == message.sender_id),
-                "Неизвестный пользователь"
-            ),
+            **serialize_message(message, sender_names.get(message.sender_id, "Неизвестный пользователь")),
             "direction": "outgoing" if message.sender_id == current_user.id else "incoming"
         }
         for message in messages
@@ -237,6 +377,240 @@ async def get_chat_messages(
         "chat_id": chat_id,
         "chat_name": chat_name,
         "messages": formatted_messages,
+        "next_cursor": next_cursor,
+    }
+
+
+def parse_search_cursor(cursor: str):
+    try:
+        rank, message_id = decode_cursor(cursor)
+        return float(rank), UUID(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный курсор"
+        )
+
+
+@router.get('/search', summary="Полнотекстовый поиск по сообщениям чатов пользователя")
+async def search_messages(
+    db: db_dependency,
+    q: str = Query(..., min_length=1, description="Поисковый запрос"),
+    current_user: dict = Depends(get_current_user),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы"),
+    limit: int = Query(20, ge=1, le=SEARCH_PAGE_MAX_LIMIT, description="Количество результатов на странице")
+):
+    ts_query = func.websearch_to_tsquery(SEARCH_TS_CONFIG, q)
+    rank = func.ts_rank_cd(Message.search_vector, ts_query)
+
+    user_chats = select(ChatParticipant.chat_id).where(ChatParticipant.user_id == current_user.id)
+
+    # Сначала отбираем страницу по GIN-индексу и рангу, подсветку строим только для неё
+    matches_query = (
+        select(Message.id, rank.label("rank"))
+        .where(
+            Message.chat_id.in_(user_chats),
+            Message.deleted_at.is_(None),
+            Message.search_vector.bool_op("@@")(ts_query)
+        )
+    )
+    if cursor:
+        matches_query = matches_query.where(tuple_(rank, Message.id) < tuple_(*parse_search_cursor(cursor)))
+    matches = (
+        matches_query
+        .order_by(rank.desc(), Message.id.desc())
+        .limit(limit + 1)
+        .subquery()
+    )
+
+    query = (
+        select(
+            Message.id,
+            Message.chat_id,
+            Message.sender_id,
+            Message.sent_at,
+            matches.c.rank,
+            func.ts_headline(SEARCH_TS_CONFIG, Message.text, ts_query, SEARCH_HEADLINE_OPTIONS).label("snippet"),
+            User.first_name,
+            User.last_name
+        )
+        .join(matches, matches.c.id == Message.id)
+        .outerjoin(User, User.id == Message.sender_id)
+        .order_by(matches.c.rank.desc(), Message.id.desc())
+    )
+    result = await db.execute(query)
+    rows = result.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].rank, rows[-1].id)
+
+    return {
+        "results": [
+            {
+                "id": row.id,
+                "chat_id": row.chat_id,
+                "sender_id": row.sender_id,
+                "sender_name": f"{row.first_name} {row.last_name}" if row.first_name else "Неизвестный пользователь",
+                "sent_at": row.sent_at,
+                "rank": row.rank,
+                "snippet": row.snippet,
+            }
+            for row in rows
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+def parse_sync_cursor(cursor: str) -> int:
+    try:
+        change_id, = decode_cursor(cursor)
+        return int(change_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный курсор"
+        )
+
+
+async def get_sync_safe_change_id(db: AsyncSession) -> int:
+    # Граница, до которой все номера изменений уже закоммичены или откачены: не выше last_value
+    # последовательности и не выше нижней границы каждой незавершённой пишущей транзакции.
+    # Порядок важен: сначала последовательность, затем блокировки, и только потом сами строки
+    last_change_id = (await db.execute(select(func.pg_sequence_last_value(SYNC_SEQUENCE)))).scalar() or 0
+    in_flight_change_id = (await db.execute(SYNC_GUARD_QUERY)).scalar()
+    if in_flight_change_id is None:
+        return last_change_id
+    return min(last_change_id, in_flight_change_id)
+
+
+@router.get('/sync', summary="Изменения в чатах пользователя после курсора")
+async def sync_chats(
+    db: db_dependency,
+    current_user: dict = Depends(get_current_user),
+    since: Optional[str] = Query(None, description="Курсор из предыдущего ответа; без него возвращается только текущий курсор"),
+    limit: int = Query(200, ge=1, le=SYNC_PAGE_MAX_LIMIT, description="Максимальное количество изменений в ответе")
+):
+    current_user_id = current_user.id
+    safe_change_id = await get_sync_safe_change_id(db)
+
+    if since is None:
+        # Начальное состояние клиент загружает через /my-chats и /chat-messages, дальше - только изменения
+        return {
+            "messages": [],
+            "deleted_messages": [],
+            "chats": [],
+            "removed_chats": [],
+            "next_cursor": encode_cursor(safe_change_id),
+            "has_more": False,
+        }
+
+    since_change_id = parse_sync_cursor(since)
+    user_chats = select(ChatParticipant.chat_id).where(ChatParticipant.user_id == current_user_id)
+
+    # Все выборки идут по индексам на change_id, поэтому стоимость зависит от числа изменений, а не от истории
+    messages_query = (
+        select(Message, User.first_name, User.last_name)
+        .outerjoin(User, User.id == Message.sender_id)
+        .where(
+            Message.change_id > since_change_id,
+            Message.change_id <= safe_change_id,
+            Message.chat_id.in_(user_chats)
+        )
+        .order_by(Message.change_id)
+        .limit(limit + 1)
+    )
+    messages_result = await db.execute(messages_query)
+    messages = messages_result.all()
+
+    chat_change_id = func.greatest(Chat.change_id, ChatParticipant.change_id)
+    chats_query = (
+        select(
+            Chat.id,
+            Chat.name,
+            Chat.is_group_chat,
+            Chat.last_message_text,
+            Chat.last_message_at,
+            Chat.last_message_sender_id,
+            ChatParticipant.unread_count,
+            chat_change_id.label("change_id")
+        )
+        .join(ChatParticipant, Chat.id == ChatParticipant.chat_id)
+        .where(
+            ChatParticipant.user_id == current_user_id,
+            Chat.request_id.is_(None),
+            or_(Chat.change_id > since_change_id, ChatParticipant.change_id > since_change_id),
+            chat_change_id <= safe_change_id
+        )
+        .order_by(chat_change_id)
+        .limit(limit + 1)
+    )
+    chats_result = await db.execute(chats_query)
+    chats = chats_result.fetchall()
+
+    removals_query = (
+        select(ChatRemoval.chat_id, ChatRemoval.change_id)
+        .where(
+            ChatRemoval.user_id == current_user_id,
+            ChatRemoval.change_id > since_change_id,
+            ChatRemoval.change_id <= safe_change_id
+        )
+        .order_by(ChatRemoval.change_id)
+        .limit(limit + 1)
+    )
+    removals_result = await db.execute(removals_query)
+    removals = removals_result.fetchall()
+
+    # В ответ попадают первые limit изменений из всех трёх источников, курсор - номер последнего из них
+    changes = sorted(
+        [("message", row.Message.change_id, row) for row in messages]
+        + [("chat", chat.change_id, chat) for chat in chats]
+        + [("removal", removal.change_id, removal) for removal in removals],
+        key=lambda change: change[1]
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if has_more:
+        next_change_id = changes[-1][1]
+    else:
+        # Всё до границы уже отдано; граница может откатиться назад, курсор - нет
+        next_change_id = max(since_change_id, safe_change_id)
+
+    formatted_messages = []
+    deleted_messages = []
+    changed_chats = []
+    removed_chats = []
+    for kind, _, row in changes:
+        if kind == "message":
+            message = row.Message
+            if message.deleted_at is not None:
+                deleted_messages.append({
+                    "id": message.id,
+                    "chat_id": message.chat_id,
+                    "deleted_at": message.deleted_at,
+                })
+            else:
+                formatted_messages.append({
+                    **serialize_message(message, f"{row.first_name} {row.last_name}" if row.first_name else "Неизвестный пользователь"),
+                    "direction": "outgoing" if message.sender_id == current_user_id else "incoming"
+                })
+        elif kind == "chat":
+            changed_chats.append(row)
+        else:
+            removed_chats.append(row.chat_id)
+
+    # Если пользователя вернули в чат, строка участника новее удаления и чат остаётся в списке
+    changed_chat_ids = {str(chat.id) for chat in changed_chats}
+    removed_chats = list(dict.fromkeys(chat_id for chat_id in removed_chats if str(chat_id) not in changed_chat_ids))
+
+    return {
+        "messages": formatted_messages,
+        "deleted_messages": deleted_messages,
+        "chats": await format_chats(db, changed_chats, current_user),
+        "removed_chats": removed_chats,
+        "next_cursor": encode_cursor(next_change_id),
+        "has_more": has_more,
     }
 
 
@@ -357,15 +731,55 @@ class MessageCreate(BaseModel):
 
 @router.post('/send-message', response_model=MessageResponse, summary="Отправка сообщения в чат")
 async def send_message(message_data: MessageCreate, db: db_dependency, current_user: dict = Depends(get_current_user)):
+    # Сначала занимается номер события чата, чтобы сохранить его в самом сообщении;
+    # now() возвращает время начала транзакции и совпадает с sent_at вставляемого сообщения
+    message_id = uuid4()
+    seq_result = await db.execute(
+        update(Chat)
+        .where(Chat.id == message_data.chat_id)
+        .values(
+            last_message_id=message_id,
+            last_message_at=func.now(),
+            last_message_text=message_data.text[:LAST_MESSAGE_PREVIEW_LENGTH],
+            last_message_sender_id=current_user.id,
+            event_seq=Chat.event_seq + 1
+        )
+        .returning(Chat.event_seq)
+    )
+    seq = seq_result.scalar_one_or_none()
+    if seq is None:
+        raise HTTPException(status_code=404, detail="Чат не найден")
+
     message = Message(
+        id=message_id,
         text=message_data.text,
         chat_id=message_data.chat_id,
-        sender_id=current_user.id
+        sender_id=current_user.id,
+        seq=seq
     )
     db.add(message)
-    await db.commit()
+    await db.flush()
     await db.refresh(message)
-    await notify_clients_about_new_message(f"{message.chat_id}")
+
+    # Одним запросом: время последнего сообщения всем участникам, непрочитанное - всем, кроме отправителя
+    await db.execute(
+        update(ChatParticipant)
+        .where(ChatParticipant.chat_id == message.chat_id)
+        .values(
+            last_message_at=func.now(),
+            unread_count=case(
+                (ChatParticipant.user_id != message.sender_id, ChatParticipant.unread_count + 1),
+                else_=ChatParticipant.unread_count
+            )
+        )
+    )
+    await db.commit()
+    await publish_chat_event(
+        message.chat_id,
+        seq,
+        "message.created",
+        {"message": serialize_message(message, f"{current_user.first_name} {current_user.last_name}")}
+    )
     return {
         "id": message.id,
         "text": message.text,
@@ -415,21 +829,30 @@ async def add_user_to_chat(
             detail="Вы не являетесь участником этого чата"
         )
 
-    existing_participant_query = select(ChatParticipant).where(
-        ChatParticipant.chat_id == chat_id,
-        ChatParticipant.user_id == user_id
-    )
-    existing_participant_result = await db.execute(existing_participant_query)
-    existing_participant = existing_participant_result.scalar_one_or_none()
-    if existing_participant:
+    # Повторное добавление отсекает уникальное ограничение (chat_id, user_id)
+    new_participant = ChatParticipant(chat_id=chat_id, user_id=user_id, last_message_at=chat.last_message_at)
+    db.add(new_participant)
+    try:
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Пользователь уже является участником этого чата"
         )
-
-    new_participant = ChatParticipant(chat_id=chat_id, user_id=user_id)
-    db.add(new_participant)
+    seq = await next_chat_seq(db, chat_id)
     await db.commit()
+    await publish_chat_event(
+        chat_id,
+        seq,
+        "participant.added",
+        {
+            "user_id": user_id,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "avatar": f"{BASE_URL}/{user.avatar}" if user.avatar else None,
+        }
+    )
 
     return {
         "message": f"Пользователь {user.first_name} {user.last_name} успешно добавлен в чат",
@@ -437,12 +860,40 @@ async def add_user_to_chat(
         "user_id": user_id
     }
 
+async def refresh_chat_last_message(db: AsyncSession, chat_id: UUID, deleted_message_id: UUID):
+    # Пересчитываем последнее сообщение, только если удалено именно оно
+    last_message_query = (
+        select(Message.id, Message.sent_at, Message.text, Message.sender_id)
+        .where(Message.chat_id == chat_id, Message.deleted_at.is_(None))
+        .order_by(Message.sent_at.desc(), Message.id.desc())
+        .limit(1)
+    )
+    last_message_result = await db.execute(last_message_query)
+    last_message = last_message_result.fetchone()
+
+    chat_result = await db.execute(
+        update(Chat)
+        .where(Chat.id == chat_id, Chat.last_message_id == deleted_message_id)
+        .values(
+            last_message_id=last_message.id if last_message else None,
+            last_message_at=last_message.sent_at if last_message else None,
+            last_message_text=last_message.text[:LAST_MESSAGE_PREVIEW_LENGTH] if last_message else None,
+            last_message_sender_id=last_message.sender_id if last_message else None
+        )
+    )
+    if chat_result.rowcount:
+        await db.execute(
+            update(ChatParticipant)
+            .where(ChatParticipant.chat_id == chat_id)
+            .values(last_message_at=last_message.sent_at if last_message else None)
+        )
+
 class DeleteMessageRequest(BaseModel):
     id: UUID
 
 @router.delete('/delete-message', summary="Удаление сообщения по id")
 async def delete_project(db: db_dependency, data: DeleteMessageRequest, current_user: dict = Depends(get_current_user)):
-    query = select(Message).where(Message.id == data.id)
+    query = select(Message).where(Message.id == data.id, Message.deleted_at.is_(None))
     result = await db.execute(query)
     message = result.scalar_one_or_none()
 
@@ -457,7 +908,54 @@ async def delete_project(db: db_dependency, data: DeleteMessageRequest, current_
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Вы не можете удалить это сообщение, так как вы не являетесь его отправителем"
         )
-    await db.delete(message)
+    # Вместо удаления строки остаётся tombstone без текста, его получат клиенты через /chats/sync
+    seq = await next_chat_seq(db, message.chat_id)
+    message.text = ""
+    message.deleted_at = func.now()
+    message.deleted_seq = seq
+    await db.flush()
+    await refresh_chat_last_message(db, message.chat_id, message.id)
+    # Удалённое сообщение перестаёт считаться непрочитанным у тех, кто до него не дочитал
+    await db.execute(
+        update(ChatParticipant)
+        .where(
+            ChatParticipant.chat_id == message.chat_id,
+            ChatParticipant.user_id != message.sender_id,
+            or_(
+                ChatParticipant.last_read_at.is_(None),
+                tuple_(ChatParticipant.last_read_at, ChatParticipant.last_read_message_id)
+                < tuple_(message.sent_at, message.id)
+            )
+        )
+        .values(unread_count=func.greatest(ChatParticipant.unread_count - 1, 0))
+    )
     await db.commit()
-    await notify_clients_about_message_deletion(chat_id=message.chat_id, message_id=message.id)
-    return {"message": "Сообщение успешно удалено"}
\ No newline at end of file
+    await publish_chat_event(message.chat_id, seq, "message.deleted", {"message_id": message.id})
+    return {"message": "Сообщение успешно удалено"}
+
+
+class MarkReadRequest(BaseModel):
+    chat_id: UUID
+    message_id: UUID
+
+@router.post('/mark-read', status_code=status.HTTP_202_ACCEPTED, summary="Отметка о прочтении сообщений чата до указанного")
+async def mark_read(data: MarkReadRequest, db: db_dependency, current_user: dict = Depends(get_current_user)):
+    message_query = (
+        select(Message.id, Message.sent_at)
+        .join(ChatParticipant, and_(
+            ChatParticipant.chat_id == Message.chat_id,
+            ChatParticipant.user_id == current_user.id
+        ))
+        .where(Message.id == data.message_id, Message.chat_id == data.chat_id, Message.deleted_at.is_(None))
+    )
+    message_result = await db.execute(message_query)
+    message = message_result.fetchone()
+    if message is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Сообщение не найдено в чатах пользователя"
+        )
+
+    # Запись в базу выполняется буфером пачкой, а не на каждую отметку
+    read_receipts.mark_read(data.chat_id, current_user.id, message.sent_at, message.id)
+    return {"message": "Отметка о прочтении принята"}
@@ -1,13 +1,63 @@
-from typing import Annotated
+import asyncio
+import itertools
+import time
+from typing import Annotated, List, Optional
 
 from fastapi import Depends
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError, DBAPIError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 import settings
+from logsHandle import logger
+from metrics import Counter, Gauge, Histogram
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    # Время ожидания свободного соединения: рост означает, что пул мал для нагрузки
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            db_pool_timeouts.inc()
+            raise
+        finally:
+            db_pool_checkout_seconds.observe(time.perf_counter() - started)
+
+
+def create_engine(url: str):
+    return create_async_engine(
+        url,
+        future=True,
+        echo=settings.DB_ECHO,
+        poolclass=InstrumentedPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={
+            # Кэш подготовленных запросов asyncpg и SQLAlchemy поверх него
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "command_timeout": settings.DB_COMMAND_TIMEOUT or None,
+        },
+    )
+
 
 # Асинхронный движок для работы с базой
-engine = create_async_engine(settings.REAL_DATABASE_URL, future=True, echo=True)
+engine = create_engine(settings.REAL_DATABASE_URL)
+
+db_pool_checkout_seconds = Histogram("welt_db_pool_checkout_seconds", "Time spent waiting for a pooled database connection")
+db_pool_timeouts = Counter("welt_db_pool_timeouts_total", "Pool checkouts that failed after DB_POOL_TIMEOUT")
+Gauge("welt_db_pool_size", "Configured pool size", function=lambda: engine.pool.size())
+Gauge("welt_db_pool_checked_out", "Connections currently in use", function=lambda: engine.pool.checkedout())
+Gauge("welt_db_pool_overflow", "Connections open above the pool size", function=lambda: max(engine.pool.overflow(), 0))
+Gauge("welt_db_pool_utilization", "Connections in use relative to pool size plus max overflow",
+      function=lambda: engine.pool.checkedout() / (settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW))
 
 # Сессия для взаимодействия с базой
 async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
@@ -22,3 +72,104 @@ async def get_db():
             await session.close()
 
 db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+
+# Отставание реплики в секундах; полностью догнавшая реплика без новых записей считается неотстающей
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.engine = create_engine(url)
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+        # До первой проверки реплика не используется
+        self.healthy = False
+        self.lag: Optional[float] = None
+
+
+class ReplicaRouter:
+    # Чтения идут по кругу на здоровые реплики; если таких нет, то на основную базу
+    def __init__(self, urls: List[str]):
+        self.replicas = [Replica(f"replica{index}", url) for index, url in enumerate(urls)]
+        self.counter = itertools.count()
+        self.health_task: Optional[asyncio.Task] = None
+
+    def pick(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self.counter) % len(healthy)]
+
+    async def check(self, replica: Replica):
+        error = None
+        try:
+            async with replica.engine.connect() as connection:
+                replica.lag = float((await connection.execute(REPLICA_LAG_QUERY)).scalar())
+            healthy = replica.lag <= settings.REPLICA_MAX_LAG_SECONDS
+        except Exception as e:
+            error = e
+            replica.lag = None
+            healthy = False
+        # В лог попадают только переходы, а не каждая неудачная проверка
+        if healthy != replica.healthy:
+            logger.info(f"Replica {replica.name} is now {'healthy' if healthy else 'unhealthy'} (lag: {replica.lag}, error: {error})")
+        replica.healthy = healthy
+
+    async def run_health_checks(self):
+        while True:
+            await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+            await asyncio.sleep(settings.REPLICA_HEALTH_CHECK_INTERVAL)
+
+    def start(self):
+        if self.replicas and self.health_task is None:
+            self.health_task = asyncio.create_task(self.run_health_checks())
+
+    async def stop(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+            try:
+                await self.health_task
+            except asyncio.CancelledError:
+                pass
+            self.health_task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+replica_router = ReplicaRouter(settings.REPLICA_DATABASE_URLS)
+
+db_replica_reads = Counter("welt_db_replica_reads_total", "Read sessions by target database", ("target",))
+Gauge("welt_db_replica_healthy", "Whether a replica receives reads", ("replica",),
+      function=lambda: {(replica.name,): int(replica.healthy) for replica in replica_router.replicas})
+Gauge("welt_db_replica_lag_seconds", "Replication lag measured by the last health check", ("replica",),
+      function=lambda: {(replica.name,): replica.lag for replica in replica_router.replicas if replica.lag is not None})
+
+
+async def get_read_db():
+    # Сессия только для чтения: соединение берётся сразу, чтобы при недоступной реплике
+    # запрос ушёл на основную базу, а не упал
+    replica = replica_router.pick()
+    if replica is not None:
+        session = replica.session()
+        try:
+            await session.connection()
+        except (DBAPIError, OSError) as e:
+            logger.warning(f"Replica {replica.name} is unavailable, reading from primary: {e}")
+            replica.healthy = False
+            await session.close()
+            replica = None
+    if replica is None:
+        session = async_session()
+    db_replica_reads.inc(target=replica.name if replica else "primary")
+    try:
+        yield session
+    finally:
+        await session.close()
+
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
@@ -1,4 +1,5 @@
 import logging
+from contextlib import asynccontextmanager
 from typing import Annotated
 
 import uvicorn
@@ -14,13 +15,36 @@ import admin
 import auth
 import chats
 import projects
+import metrics
 import my_websockets
 import requests
 import tasks
 import users
-from database import async_session
+from broadcast import broadcast
+from database import async_session, replica_router
+from my_websockets import registry as websocket_registry
+from query_stats import query_stats_middleware
+from read_receipts import read_receipts
+from reference_data import load_reference_data, reference_reloader
 
-app = FastAPI(title="WeltAPI")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await broadcast.connect()
+    await load_reference_data()
+    reference_reloader.start()
+    read_receipts.start()
+    websocket_registry.start_heartbeat()
+    replica_router.start()
+    yield
+    await replica_router.stop()
+    await websocket_registry.stop_heartbeat()
+    await read_receipts.stop()
+    await reference_reloader.stop()
+    await broadcast.disconnect()
+
+
+app = FastAPI(title="WeltAPI", lifespan=lifespan)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
@@ -39,6 +63,8 @@ app.add_middleware(
 
 )
 
+app.middleware("http")(query_stats_middleware)
+
 app.include_router(auth.router)
 app.include_router(admin.router)
 app.include_router(chats.router)
@@ -47,6 +73,7 @@ app.include_router(my_websockets.router)
 app.include_router(requests.router)
 app.include_router(users.router)
 app.include_router(tasks.router)
+app.include_router(metrics.router)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 async def get_db():
@@ -0,0 +1,28 @@
+"""add chat event seq
+
+Revision ID: 0e6b8f3d4a27
+Revises: f7d93a61c2e4
+Create Date: 2026-10-18 13:48:02.337195
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0e6b8f3d4a27'
+down_revision: Union[str, None] = 'f7d93a61c2e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chats', sa.Column('event_seq', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('chats', 'event_seq')
@@ -0,0 +1,41 @@
+"""add messages keyset index
+
+Revision ID: 3b7c1e9a2f40
+Revises: 6855deb55be6
+Create Date: 2026-10-18 11:02:14.514203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7c1e9a2f40'
+down_revision: Union[str, None] = '6855deb55be6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Индекс строится без блокировки записи в таблицу сообщений
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_chat_id_sent_at_id',
+            'messages',
+            ['chat_id', 'sent_at', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_messages_chat_id_sent_at_id',
+            table_name='messages',
+            postgresql_concurrently=True,
+        )
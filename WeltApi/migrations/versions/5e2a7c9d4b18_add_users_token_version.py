@@ -0,0 +1,28 @@
+"""add users token version
+
+Revision ID: 5e2a7c9d4b18
+Revises: d3f19b7a6c05
+Create Date: 2026-10-18 15:47:11.582903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2a7c9d4b18'
+down_revision: Union[str, None] = 'd3f19b7a6c05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'token_version')
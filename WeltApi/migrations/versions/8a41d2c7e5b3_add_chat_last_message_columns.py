@@ -0,0 +1,68 @@
+"""add chat last message columns
+
+Revision ID: 8a41d2c7e5b3
+Revises: 3b7c1e9a2f40
+Create Date: 2026-10-18 11:40:52.118930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a41d2c7e5b3'
+down_revision: Union[str, None] = '3b7c1e9a2f40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LAST_MESSAGE_PREVIEW_LENGTH = 200
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chats', sa.Column('last_message_id', sa.UUID(), nullable=True))
+    op.add_column('chats', sa.Column('last_message_at', sa.DateTime(), nullable=True))
+    op.add_column('chats', sa.Column('last_message_text', sa.String(), nullable=True))
+    op.add_column('chats', sa.Column('last_message_sender_id', sa.UUID(), nullable=True))
+
+    # Заполняем последнее сообщение для уже существующих чатов
+    op.execute(
+        f"""
+        UPDATE chats
+        SET last_message_id = last_message.id,
+            last_message_at = last_message.sent_at,
+            last_message_text = left(last_message.text, {LAST_MESSAGE_PREVIEW_LENGTH}),
+            last_message_sender_id = last_message.sender_id
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, id, sent_at, text, sender_id
+            FROM messages
+            ORDER BY chat_id, sent_at DESC, id DESC
+        ) AS last_message
+        WHERE chats.id = last_message.chat_id
+        """
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_chats_last_message_at',
+            'chats',
+            [sa.text('last_message_at DESC NULLS LAST'), sa.text('id DESC')],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_chats_last_message_at',
+            table_name='chats',
+            postgresql_concurrently=True,
+        )
+    op.drop_column('chats', 'last_message_sender_id')
+    op.drop_column('chats', 'last_message_text')
+    op.drop_column('chats', 'last_message_id')
+    op.drop_column('chats', 'last_message_at')
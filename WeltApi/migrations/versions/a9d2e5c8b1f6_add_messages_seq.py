@@ -0,0 +1,43 @@
+"""add messages seq
+
+Revision ID: a9d2e5c8b1f6
+Revises: 0e6b8f3d4a27
+Create Date: 2026-10-18 14:21:37.905114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9d2e5c8b1f6'
+down_revision: Union[str, None] = '0e6b8f3d4a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Номер события уже отправленных сообщений не восстановить, у них seq остаётся пустым
+    op.add_column('messages', sa.Column('seq', sa.Integer(), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_chat_id_seq',
+            'messages',
+            ['chat_id', 'seq'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_messages_chat_id_seq',
+            table_name='messages',
+            postgresql_concurrently=True,
+        )
+    op.drop_column('messages', 'seq')
@@ -0,0 +1,70 @@
+"""add foreign key indexes and membership unique constraints
+
+Revision ID: b6c4e1f9a3d2
+Revises: 5e2a7c9d4b18
+Create Date: 2026-10-18 16:31:08.460217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6c4e1f9a3d2'
+down_revision: Union[str, None] = '5e2a7c9d4b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# chat_participants(user_id) покрыт ix_chat_participants_user_id_change_id,
+# messages(chat_id, sent_at) - ix_messages_chat_id_sent_at_id
+INDEXES = (
+    ('ix_task_assignments_user_id', 'task_assignments', ['user_id']),
+    ('ix_tasks_project_id_status_id', 'tasks', ['project_id', 'status_id']),
+    ('ix_projects_users_user_id', 'projects_users', ['user_id']),
+    ('ix_requests_receiver_id', 'requests', ['receiver_id']),
+    ('ix_requests_sender_id', 'requests', ['sender_id']),
+)
+
+# Уникальные индексы заодно обслуживают поиск по первой колонке (chat_id, project_id)
+UNIQUE_CONSTRAINTS = (
+    ('uq_chat_participants_chat_id_user_id', 'chat_participants', ['chat_id', 'user_id']),
+    ('uq_projects_users_project_id_user_id', 'projects_users', ['project_id', 'user_id']),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Дубликаты мешают построить уникальные индексы. Удаление лишних участников чата
+    # не должно оставлять записи в chat_removals: пользователь из чата не уходит
+    op.execute("ALTER TABLE chat_participants DISABLE TRIGGER chat_participants_removed")
+    for _, table, columns in UNIQUE_CONSTRAINTS:
+        op.execute(
+            f"""
+            DELETE FROM {table} a
+            USING {table} b
+            WHERE {' AND '.join(f'a.{column} = b.{column}' for column in columns)}
+              AND a.ctid > b.ctid
+            """
+        )
+    op.execute("ALTER TABLE chat_participants ENABLE TRIGGER chat_participants_removed")
+
+    with op.get_context().autocommit_block():
+        for name, table, columns in UNIQUE_CONSTRAINTS:
+            op.create_index(name, table, columns, unique=True, postgresql_concurrently=True)
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+    # Ограничение поверх готового индекса добавляется без повторного сканирования таблицы
+    for name, table, _ in UNIQUE_CONSTRAINTS:
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name, table, _ in UNIQUE_CONSTRAINTS:
+        op.drop_constraint(name, table, type_='unique')
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
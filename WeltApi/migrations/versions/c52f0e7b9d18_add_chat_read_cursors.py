@@ -0,0 +1,44 @@
+"""add chat read cursors
+
+Revision ID: c52f0e7b9d18
+Revises: 8a41d2c7e5b3
+Create Date: 2026-10-18 12:21:37.604411
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52f0e7b9d18'
+down_revision: Union[str, None] = '8a41d2c7e5b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chat_participants', sa.Column('last_read_message_id', sa.UUID(), nullable=True))
+    op.add_column('chat_participants', sa.Column('last_read_at', sa.DateTime(), nullable=True))
+    op.add_column('chat_participants', sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Существующая история считается прочитанной
+    op.execute(
+        """
+        UPDATE chat_participants
+        SET last_read_message_id = chats.last_message_id,
+            last_read_at = chats.last_message_at
+        FROM chats
+        WHERE chats.id = chat_participants.chat_id
+          AND chats.last_message_id IS NOT NULL
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('chat_participants', 'unread_count')
+    op.drop_column('chat_participants', 'last_read_at')
+    op.drop_column('chat_participants', 'last_read_message_id')
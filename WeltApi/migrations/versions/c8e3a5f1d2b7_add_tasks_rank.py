@@ -0,0 +1,79 @@
+"""add tasks rank
+
+Revision ID: c8e3a5f1d2b7
+Revises: b6c4e1f9a3d2
+Create Date: 2026-10-18 19:12:46.538920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8e3a5f1d2b7'
+down_revision: Union[str, None] = 'b6c4e1f9a3d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Должны совпадать с ranking.DIGITS; четыре цифры дают 62^4 позиций на колонку
+RANK_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+RANK_WIDTH = 4
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tasks', sa.Column('rank', sa.String(collation='C'), nullable=True))
+
+    # Существующие задачи расставляются равномерно в порядке создания внутри своей колонки,
+    # хвостовые нули отбрасываются так же, как в ranking.spaced_ranks
+    digits = " || ".join(
+        f"substr(:digits, ((value / {62 ** power}) % 62)::int + 1, 1)"
+        for power in reversed(range(RANK_WIDTH))
+    )
+    op.execute(
+        sa.text(
+            f"""
+            WITH ordered AS (
+                SELECT id,
+                       row_number() OVER (PARTITION BY project_id, status_id ORDER BY created_at, id) AS position,
+                       count(*) OVER (PARTITION BY project_id, status_id) AS total
+                FROM tasks
+            ), spaced AS (
+                SELECT id, position * ({62 ** RANK_WIDTH} / (total + 1)) AS value
+                FROM ordered
+            )
+            UPDATE tasks
+            SET rank = rtrim({digits}, '0')
+            FROM spaced
+            WHERE tasks.id = spaced.id
+            """
+        ).bindparams(digits=RANK_DIGITS)
+    )
+    op.alter_column('tasks', 'rank', nullable=False)
+
+    # Новый индекс начинается с (project_id, status_id) и заменяет прежний
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_tasks_project_id_status_id_rank',
+            'tasks',
+            ['project_id', 'status_id', 'rank'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_tasks_project_id_status_id', table_name='tasks', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_tasks_project_id_status_id',
+            'tasks',
+            ['project_id', 'status_id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_tasks_project_id_status_id_rank', table_name='tasks', postgresql_concurrently=True)
+    op.drop_column('tasks', 'rank')
@@ -0,0 +1,146 @@
+"""add sync change ids and tombstones
+
+Revision ID: d3f19b7a6c05
+Revises: a9d2e5c8b1f6
+Create Date: 2026-10-18 15:02:44.118630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3f19b7a6c05'
+down_revision: Union[str, None] = 'a9d2e5c8b1f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 5000
+SYNC_TABLES = ('messages', 'chats', 'chat_participants')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Общий счётчик изменений для /chats/sync: любая вставка или изменение строки получает новый номер
+    op.execute("CREATE SEQUENCE sync_change_id_seq")
+    for table in SYNC_TABLES:
+        op.add_column(table, sa.Column('change_id', sa.BigInteger(), nullable=True))
+    op.add_column('messages', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('messages', sa.Column('deleted_seq', sa.Integer(), nullable=True))
+
+    # Удаление участника (в том числе каскадом вместе с чатом) оставляет запись для синхронизации
+    op.create_table(
+        'chat_removals',
+        sa.Column('id', sa.BigInteger(), sa.Identity(), primary_key=True),
+        sa.Column('chat_id', postgresql.UUID(), nullable=False),
+        sa.Column('user_id', postgresql.UUID(), nullable=False),
+        sa.Column('change_id', sa.BigInteger(), nullable=False),
+        sa.Column('removed_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    )
+    op.create_index('ix_chat_removals_user_id_change_id', 'chat_removals', ['user_id', 'change_id'], unique=False)
+
+    op.execute(
+        """
+        CREATE FUNCTION sync_change_id_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.change_id := nextval('sync_change_id_seq');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    for table in SYNC_TABLES:
+        op.execute(
+            f"""
+            CREATE TRIGGER {table}_sync_change_id
+            BEFORE INSERT OR UPDATE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION sync_change_id_update()
+            """
+        )
+    op.execute(
+        """
+        CREATE FUNCTION chat_participants_removed() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO chat_removals (chat_id, user_id, change_id)
+            VALUES (OLD.chat_id, OLD.user_id, nextval('sync_change_id_seq'));
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER chat_participants_removed
+        AFTER DELETE ON chat_participants
+        FOR EACH ROW EXECUTE FUNCTION chat_participants_removed()
+        """
+    )
+
+    with op.get_context().autocommit_block():
+        # Номер выставляет триггер, пачки коммитятся отдельно, как при заполнении search_vector
+        connection = op.get_bind()
+        for table in SYNC_TABLES:
+            while True:
+                result = connection.execute(
+                    sa.text(
+                        f"""
+                        UPDATE {table}
+                        SET change_id = nextval('sync_change_id_seq')
+                        WHERE id IN (
+                            SELECT id FROM {table}
+                            WHERE change_id IS NULL
+                            LIMIT :batch_size
+                        )
+                        """
+                    ),
+                    {"batch_size": BACKFILL_BATCH_SIZE},
+                )
+                if result.rowcount == 0:
+                    break
+
+        op.create_index(
+            'ix_messages_change_id',
+            'messages',
+            ['change_id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_chats_change_id',
+            'chats',
+            ['change_id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_chat_participants_user_id_change_id',
+            'chat_participants',
+            ['user_id', 'change_id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_chat_participants_user_id_change_id', table_name='chat_participants', postgresql_concurrently=True)
+        op.drop_index('ix_chats_change_id', table_name='chats', postgresql_concurrently=True)
+        op.drop_index('ix_messages_change_id', table_name='messages', postgresql_concurrently=True)
+    op.execute("DROP TRIGGER IF EXISTS chat_participants_removed ON chat_participants")
+    op.execute("DROP FUNCTION IF EXISTS chat_participants_removed()")
+    for table in SYNC_TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_sync_change_id ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS sync_change_id_update()")
+    op.drop_index('ix_chat_removals_user_id_change_id', table_name='chat_removals')
+    op.drop_table('chat_removals')
+    # Удалённые сообщения были мягкими, после отката они снова стали бы видны
+    op.execute("DELETE FROM messages WHERE deleted_at IS NOT NULL")
+    op.drop_column('messages', 'deleted_seq')
+    op.drop_column('messages', 'deleted_at')
+    for table in SYNC_TABLES:
+        op.drop_column(table, 'change_id')
+    op.execute("DROP SEQUENCE sync_change_id_seq")
@@ -0,0 +1,90 @@
+"""guard sync change ids of in-flight transactions
+
+Revision ID: e4b9d2a7c1f3
+Revises: c8e3a5f1d2b7
+Create Date: 2026-10-18 21:04:17.219835
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b9d2a7c1f3'
+down_revision: Union[str, None] = 'c8e3a5f1d2b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Должен совпадать с chats.SYNC_GUARD_LOCK_OFFSET: отделяет эти advisory-блокировки от любых других
+SYNC_GUARD_LOCK_OFFSET = 1 << 62
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Номер выдаётся при записи, а виден после коммита. Перед первым номером транзакция берёт
+    # разделяемую advisory-блокировку с текущим last_value последовательности: все её номера больше
+    # этого значения, и /chats/sync не продвигает курсор дальше, пока блокировка держится
+    op.execute(
+        f"""
+        CREATE FUNCTION sync_change_id_next() RETURNS bigint AS $$
+        BEGIN
+            IF coalesce(current_setting('welt.sync_change_guard', true), '') = '' THEN
+                PERFORM pg_advisory_xact_lock_shared(
+                    {SYNC_GUARD_LOCK_OFFSET} + coalesce(pg_sequence_last_value('sync_change_id_seq'), 0)
+                );
+                PERFORM set_config('welt.sync_change_guard', 'on', true);
+            END IF;
+            RETURN nextval('sync_change_id_seq');
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION sync_change_id_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.change_id := sync_change_id_next();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION chat_participants_removed() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO chat_removals (chat_id, user_id, change_id)
+            VALUES (OLD.chat_id, OLD.user_id, sync_change_id_next());
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION sync_change_id_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.change_id := nextval('sync_change_id_seq');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION chat_participants_removed() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO chat_removals (chat_id, user_id, change_id)
+            VALUES (OLD.chat_id, OLD.user_id, nextval('sync_change_id_seq'));
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute("DROP FUNCTION sync_change_id_next()")
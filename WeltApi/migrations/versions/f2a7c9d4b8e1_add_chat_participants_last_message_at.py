@@ -0,0 +1,66 @@
+"""add chat participants last message at
+
+Revision ID: f2a7c9d4b8e1
+Revises: e4b9d2a7c1f3
+Create Date: 2026-10-18 22:37:05.614283
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a7c9d4b8e1'
+down_revision: Union[str, None] = 'e4b9d2a7c1f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Копия chats.last_message_at у каждого участника: /chats/my-chats читает страницу
+    # пользователя по индексу, не перебирая чаты всех остальных
+    op.add_column('chat_participants', sa.Column('last_message_at', sa.DateTime(), nullable=True))
+
+    # Заполнение не меняет ничего видимого для /chats/sync, поэтому change_id не выдаются
+    op.execute("ALTER TABLE chat_participants DISABLE TRIGGER chat_participants_sync_change_id")
+    op.execute(
+        """
+        UPDATE chat_participants
+        SET last_message_at = chats.last_message_at
+        FROM chats
+        WHERE chats.id = chat_participants.chat_id
+          AND chats.last_message_at IS NOT NULL
+        """
+    )
+    op.execute("ALTER TABLE chat_participants ENABLE TRIGGER chat_participants_sync_change_id")
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_chat_participants_user_id_last_message_at',
+            'chat_participants',
+            ['user_id', sa.text('last_message_at DESC NULLS LAST'), sa.text('chat_id DESC')],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_chats_last_message_at', table_name='chats', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_chats_last_message_at',
+            'chats',
+            [sa.text('last_message_at DESC NULLS LAST'), sa.text('id DESC')],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_chat_participants_user_id_last_message_at',
+            table_name='chat_participants',
+            postgresql_concurrently=True,
+        )
+    op.drop_column('chat_participants', 'last_message_at')
@@ -0,0 +1,89 @@
+"""add messages full text search
+
+Revision ID: f7d93a61c2e4
+Revises: c52f0e7b9d18
+Create Date: 2026-10-18 13:05:19.880261
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7d93a61c2e4'
+down_revision: Union[str, None] = 'c52f0e7b9d18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Колонка без значения по умолчанию добавляется без перезаписи таблицы
+    op.add_column('messages', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+
+    # Конфигурация 'russian' должна совпадать с SEARCH_TS_CONFIG в chats.py
+    op.execute(
+        """
+        CREATE FUNCTION messages_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := to_tsvector('russian', coalesce(NEW.text, ''));
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER messages_search_vector_update
+        BEFORE INSERT OR UPDATE OF text ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_search_vector_update()
+        """
+    )
+
+    with op.get_context().autocommit_block():
+        # Каждая пачка коммитится отдельно, блокировки держатся только на обновляемых строках
+        connection = op.get_bind()
+        while True:
+            result = connection.execute(
+                sa.text(
+                    """
+                    UPDATE messages
+                    SET search_vector = to_tsvector('russian', coalesce(text, ''))
+                    WHERE id IN (
+                        SELECT id FROM messages
+                        WHERE search_vector IS NULL
+                        LIMIT :batch_size
+                    )
+                    """
+                ),
+                {"batch_size": BACKFILL_BATCH_SIZE},
+            )
+            if result.rowcount == 0:
+                break
+
+        op.create_index(
+            'ix_messages_search_vector',
+            'messages',
+            ['search_vector'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_messages_search_vector',
+            table_name='messages',
+            postgresql_concurrently=True,
+        )
+    op.execute("DROP TRIGGER IF EXISTS messages_search_vector_update ON messages")
+    op.execute("DROP FUNCTION IF EXISTS messages_search_vector_update()")
+    op.drop_column('messages', 'search_vector')
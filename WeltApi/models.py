@@ -2,8 +2,10 @@
 import uuid
 from enum import Enum
 
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy import Column, String, Boolean, DateTime, func, ForeignKey, Integer
+from sqlalchemy.dialects.postgresql import UUID, TSVECTOR
+from sqlalchemy import Column, String, Boolean, DateTime, func, ForeignKey, Integer, Index, BigInteger, Identity, \
+    UniqueConstraint
+from sqlalchemy.orm import deferred
 
 from database import Base
 
@@ -32,6 +34,8 @@ class User(Base):
     avatar = Column(String, nullable=True)
     created_at = Column(DateTime, default=func.now())
     role_id = Column(UUID, ForeignKey("roles.id", ondelete='SET DEFAULT'), nullable=False, default=0)
+    # Версия токенов без обращения к базе (STATELESS_AUTH): увеличение отзывает все выданные токены
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
 # Статусы заявок
 class RequestStatus(Base):
@@ -51,6 +55,11 @@ class Request(Base):
     receiver_id=Column(UUID, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     created_at = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        Index("ix_requests_receiver_id", "receiver_id"),
+        Index("ix_requests_sender_id", "sender_id"),
+    )
+
 
 # Статусы задач
 class TaskStatus(Base):
@@ -74,18 +83,33 @@ class Task(Base):
     deadline = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # Порядок внутри колонки доски, ключи из ranking.rank_between
+    rank = Column(String(collation="C"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_tasks_project_id_status_id_rank", "project_id", "status_id", "rank"),
+    )
 
 class TaskAssignment(Base):
     __tablename__ = "task_assignments"
     task_id = Column(UUID, ForeignKey("tasks.id", ondelete="CASCADE"), primary_key=True)
     user_id = Column(UUID, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
 
+    __table_args__ = (
+        Index("ix_task_assignments_user_id", "user_id"),
+    )
+
 class ProjectUser(Base):
     __tablename__="projects_users"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     project_id = Column(UUID, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(UUID, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
 
+    __table_args__ = (
+        UniqueConstraint("project_id", "user_id", name="uq_projects_users_project_id_user_id"),
+        Index("ix_projects_users_user_id", "user_id"),
+    )
+
 class Chat(Base):
     __tablename__="chats"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -93,12 +117,56 @@ class Chat(Base):
     project_id = Column(UUID, ForeignKey("projects.id", ondelete="CASCADE"), nullable=True)
     request_id = Column(Integer, ForeignKey("requests.id", ondelete="CASCADE"), nullable=True)
     is_group_chat = Column(Boolean, default=False)
+    # Денормализованные данные последнего сообщения для списка чатов
+    last_message_id = Column(UUID, nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+    last_message_text = Column(String, nullable=True)
+    last_message_sender_id = Column(UUID, nullable=True)
+    # Номер последнего события чата, рассылаемого по WebSocket
+    event_seq = Column(Integer, nullable=False, default=0, server_default="0")
+    # Номер из sync_change_id_seq, выставляется триггером sync_change_id_update при каждом изменении
+    change_id = Column(BigInteger, nullable=True)
+
+    __table_args__ = (
+        Index("ix_chats_change_id", "change_id"),
+    )
 
 class ChatParticipant(Base):
     __tablename__="chat_participants"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     chat_id = Column(UUID, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(UUID, ForeignKey("users.id"), nullable=False)
+    # Курсор прочтения (sent_at, id) и счётчик непрочитанных сообщений участника
+    last_read_message_id = Column(UUID, nullable=True)
+    last_read_at = Column(DateTime, nullable=True)
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+    change_id = Column(BigInteger, nullable=True)
+    # Копия chats.last_message_at: список чатов пользователя читается по индексу участника
+    last_message_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("chat_id", "user_id", name="uq_chat_participants_chat_id_user_id"),
+        Index("ix_chat_participants_user_id_change_id", "user_id", "change_id"),
+        Index(
+            "ix_chat_participants_user_id_last_message_at",
+            "user_id",
+            last_message_at.desc().nulls_last(),
+            chat_id.desc(),
+        ),
+    )
+
+# Заполняется триггером chat_participants_removed: пользователь больше не видит чат
+class ChatRemoval(Base):
+    __tablename__="chat_removals"
+    id = Column(BigInteger, Identity(), primary_key=True)
+    chat_id = Column(UUID, nullable=False)
+    user_id = Column(UUID, nullable=False)
+    change_id = Column(BigInteger, nullable=False)
+    removed_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_chat_removals_user_id_change_id", "user_id", "change_id"),
+    )
 
 class Message(Base):
     __tablename__="messages"
@@ -107,6 +175,21 @@ class Message(Base):
     sender_id = Column(UUID, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     chat_id = Column(UUID, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     sent_at = Column(DateTime, default=func.now())
+    # Номер события message.created в чате, по нему догружаются пропущенные после переподключения
+    seq = Column(Integer, nullable=True)
+    # Удалённое сообщение остаётся в таблице без текста, чтобы клиенты узнали об удалении через /chats/sync
+    deleted_at = Column(DateTime, nullable=True)
+    deleted_seq = Column(Integer, nullable=True)
+    change_id = Column(BigInteger, nullable=True)
+    # Заполняется триггером messages_search_vector_update, в обычных выборках не загружается
+    search_vector = deferred(Column(TSVECTOR, nullable=True))
+
+    __table_args__ = (
+        Index("ix_messages_chat_id_sent_at_id", "chat_id", "sent_at", "id"),
+        Index("ix_messages_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_messages_chat_id_seq", "chat_id", "seq"),
+        Index("ix_messages_change_id", "change_id"),
+    )
 
 class MessageStatus(Base):
     __tablename__="message_statuses"
@@ -1,68 +1,529 @@
-from typing import Dict
-from fastapi import WebSocket, APIRouter
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Set, Optional, List
+from uuid import UUID
+
+from fastapi import WebSocket, APIRouter, HTTPException
+from fastapi.encoders import jsonable_encoder
 from fastapi.websockets import WebSocketDisconnect
+from sqlalchemy import select, func
 
+import settings
+from auth import authenticate_token, CurrentUser
+from broadcast import broadcast, PayloadTooLarge, record_publish_failure
+from database import async_session
 from logsHandle import logger
+from metrics import Counter, Gauge, Histogram
+from models import Chat, ChatParticipant, Message, User, ProjectUser
+
+CHAT_EVENTS_TOPIC = "chat_events"
+PROJECT_EVENTS_TOPIC = "project_events"
+# Подписки на доски проектов хранятся в реестре рядом с чатами под ключами с этим префиксом
+PROJECT_KEY_PREFIX = "project:"
 
-active_connections: Dict[str, list] = {}
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DISCONNECT = "disconnect"
+# Код закрытия "Try Again Later" для отключённых медленных клиентов
+SLOW_CONSUMER_CLOSE_CODE = 1013
+POLICY_VIOLATION_CLOSE_CODE = 1008
+# Код закрытия "Going Away" для клиентов, не ответивших на ping
+IDLE_CLOSE_CODE = 1001
 
 router = APIRouter(
     prefix='/sockets',
     tags=['sockets']
 )
 
+
+class ClientConnection:
+    # Каждый сокет получает события через собственную ограниченную очередь
+    # и отдельную задачу-писателя, поэтому медленный клиент не задерживает остальных
+    def __init__(self, websocket: WebSocket, user_id: Optional[str] = None, heartbeat: bool = False,
+                 legacy: bool = False):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.heartbeat = heartbeat
+        # Сокет без авторизации получает только уведомления без содержимого чата
+        self.legacy = legacy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.chats: Set[str] = set()
+        self.writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.last_seen = time.monotonic()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, event: dict) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            if settings.WS_OVERFLOW_POLICY != OVERFLOW_DROP_OLDEST:
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(event)
+            ws_events_dropped.inc()
+            logger.warning("WebSocket send queue is full, dropped the oldest event")
+            return True
+
+    async def _write_loop(self):
+        try:
+            while True:
+                event = await self.queue.get()
+                started = time.perf_counter()
+                send = self.websocket.send_text(event) if isinstance(event, str) else self.websocket.send_json(event)
+                await asyncio.wait_for(send, settings.WS_SEND_TIMEOUT)
+                ws_send_seconds.observe(time.perf_counter() - started)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending event to client: {e}")
+            registry.unregister(self, reason="send_error")
+            await self.close()
+
+    async def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer is not None and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class ConnectionRegistry:
+    # Сокеты, открытые в текущем процессе; события из других воркеров приходят через broadcast
+    def __init__(self):
+        self.connections: Set[ClientConnection] = set()
+        self.by_chat: Dict[str, Set[ClientConnection]] = {}
+        self.by_user: Dict[str, Set[ClientConnection]] = {}
+        self.heartbeat_task: Optional[asyncio.Task] = None
+
+    def register(self, connection: ClientConnection):
+        self.connections.add(connection)
+        ws_connections_opened.inc()
+        if connection.user_id is not None:
+            self.by_user.setdefault(connection.user_id, set()).add(connection)
+
+    def subscribe(self, connection: ClientConnection, chat_id: str):
+        self.by_chat.setdefault(chat_id, set()).add(connection)
+        connection.chats.add(chat_id)
+
+    def unsubscribe(self, connection: ClientConnection, chat_id: str):
+        connections = self.by_chat.get(chat_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.by_chat[chat_id]
+        connection.chats.discard(chat_id)
+
+    def unregister(self, connection: ClientConnection, reason: str = "closed"):
+        if connection in self.connections:
+            self.connections.discard(connection)
+            ws_connections_closed.inc(reason=reason)
+        for chat_id in list(connection.chats):
+            self.unsubscribe(connection, chat_id)
+        connections = self.by_user.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.by_user[connection.user_id]
+
+    def subscribe_user(self, user_id: str, chat_id: str):
+        for connection in list(self.by_user.get(user_id, ())):
+            self.subscribe(connection, chat_id)
+
+    def fan_out(self, chat_id: str, event: dict):
+        # Только постановка в очереди: отправку выполняют задачи-писатели соединений
+        for connection in list(self.by_chat.get(chat_id, ())):
+            payload = legacy_notification(event) if connection.legacy else event
+            if payload is None:
+                continue
+            if not connection.enqueue(payload):
+                logger.warning(f"Disconnecting slow WebSocket consumer in chat_id: {chat_id}")
+                self.unregister(connection, reason="slow_consumer")
+                asyncio.create_task(connection.close(code=SLOW_CONSUMER_CLOSE_CODE))
+
+    async def run_heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.WS_PING_INTERVAL)
+            deadline = time.monotonic() - settings.WS_PING_INTERVAL - settings.WS_PING_TIMEOUT
+            for connection in list(self.connections):
+                if not connection.heartbeat:
+                    continue
+                if connection.last_seen < deadline:
+                    logger.info(f"Evicting unresponsive WebSocket of user_id: {connection.user_id}")
+                    self.unregister(connection, reason="idle")
+                    asyncio.create_task(connection.close(code=IDLE_CLOSE_CODE))
+                else:
+                    connection.enqueue({"type": "ping"})
+
+    def start_heartbeat(self):
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.create_task(self.run_heartbeat())
+
+    async def stop_heartbeat(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self.heartbeat_task = None
+
+
+class ReplayBuffer:
+    # Последние события каждого чата в порядке seq. Все воркеры получают события через broadcast,
+    # поэтому клиент может досинхронизироваться на любом из них
+    def __init__(self, size: int, max_chats: int):
+        self.size = size
+        self.max_chats = max_chats
+        self.chats: "OrderedDict[str, deque]" = OrderedDict()
+
+    def append(self, event: dict):
+        chat_id = event["chat_id"]
+        events = self.chats.get(chat_id)
+        if events is None:
+            events = self.chats[chat_id] = deque(maxlen=self.size)
+            if len(self.chats) > self.max_chats:
+                self.chats.popitem(last=False)
+        else:
+            self.chats.move_to_end(chat_id)
+        events.append(event)
+
+    def events_after(self, chat_id: str, last_seq: int) -> Optional[List[dict]]:
+        # None, если буфер не покрывает пропуск целиком и нужен запрос к базе
+        events = self.chats.get(chat_id)
+        if not events:
+            return None
+        # Публикации из разных запросов могут прийти не в порядке seq
+        missed = sorted((event for event in events if event["seq"] > last_seq), key=lambda event: event["seq"])
+        if missed and [event["seq"] for event in missed] != list(range(last_seq + 1, last_seq + 1 + len(missed))):
+            return None
+        return missed
+
+
+registry = ConnectionRegistry()
+replay_buffer = ReplayBuffer(settings.WS_REPLAY_BUFFER_SIZE, settings.WS_REPLAY_MAX_CHATS)
+
+
+def chat_subscriber_counts() -> List[int]:
+    # Только агрегаты по воркеру: метка chat_id дала бы по временному ряду на каждый чат
+    return [len(connections) for key, connections in registry.by_chat.items() if not key.startswith(PROJECT_KEY_PREFIX)]
+
+
+ws_connections_opened = Counter("welt_ws_connections_opened_total", "WebSocket connections opened")
+ws_connections_closed = Counter("welt_ws_connections_closed_total", "WebSocket connections closed", ("reason",))
+ws_events_dropped = Counter("welt_ws_events_dropped_total", "Events dropped because a send queue was full")
+ws_send_seconds = Histogram("welt_ws_send_seconds", "Time spent sending one event to a WebSocket")
+Gauge("welt_ws_connections_open", "Currently open WebSocket connections",
+      function=lambda: len(registry.connections))
+Gauge("welt_ws_subscribed_chats", "Chats with at least one local WebSocket subscriber",
+      function=lambda: len(chat_subscriber_counts()))
+Gauge("welt_ws_chat_subscriptions", "Local WebSocket subscriptions to chats",
+      function=lambda: sum(chat_subscriber_counts()))
+Gauge("welt_ws_chat_subscribers_max", "Local WebSocket subscribers of the most subscribed chat",
+      function=lambda: max(chat_subscriber_counts(), default=0))
+Gauge("welt_ws_project_subscribers", "Local WebSocket subscriptions to project boards",
+      function=lambda: sum(len(connections) for key, connections in registry.by_chat.items()
+                           if key.startswith(PROJECT_KEY_PREFIX)))
+Gauge("welt_ws_send_queue_depth", "Events waiting in all WebSocket send queues",
+      function=lambda: sum(connection.queue.qsize() for connection in registry.connections))
+ws_replays = Counter("welt_ws_replays_total", "Resume requests by the source of missed events", ("source",))
+Gauge("welt_ws_replay_buffer_chats", "Chats held in the replay buffer",
+      function=lambda: len(replay_buffer.chats))
+Gauge("welt_ws_send_queue_depth_max", "Largest WebSocket send queue",
+      function=lambda: max((connection.queue.qsize() for connection in registry.connections), default=0))
+
+
+async def get_user_chat_ids(user_id: UUID, chat_id: Optional[str] = None):
+    query = select(ChatParticipant.chat_id).where(ChatParticipant.user_id == user_id)
+    if chat_id is not None:
+        query = query.where(ChatParticipant.chat_id == chat_id)
+    async with async_session() as db:
+        result = await db.execute(query)
+        return [str(chat_id) for chat_id in result.scalars().all()]
+
+
+def legacy_notification(event: dict):
+    # Формат старого клиента: текст о новом сообщении и id удалённого, без текста и отправителя
+    if event["type"] == "message.created":
+        return "New message received"
+    if event["type"] == "message.deleted" and event.get("data"):
+        return {"action": "delete", "message_id": event["data"]["message_id"]}
+    return None
+
+
+def project_key(project_id) -> str:
+    return f"{PROJECT_KEY_PREFIX}{project_id}"
+
+
+async def is_project_member(user_id: UUID, project_id: str) -> bool:
+    query = select(ProjectUser.id).where(ProjectUser.user_id == user_id, ProjectUser.project_id == project_id)
+    async with async_session() as db:
+        result = await db.execute(query.limit(1))
+        return result.scalar_one_or_none() is not None
+
+
+def serialize_message(message: Message, sender_name: str):
+    return {
+        "id": message.id,
+        "chat_id": message.chat_id,
+        "text": message.text,
+        "sent_at": message.sent_at,
+        "sender_id": message.sender_id,
+        "sender_name": sender_name,
+    }
+
+
+async def load_missed_events(chat_id: str, last_seq: int, limit: int):
+    # Запасной путь, когда буфер уже вытеснил пропущенные события: сообщения и tombstones с seq больше last_seq.
+    # Возвращает и признак полноты: остальные события чата (participant.added) в базе не хранятся
+    event_seq = func.coalesce(Message.deleted_seq, Message.seq)
+    async with async_session() as db:
+        current_seq = (await db.execute(select(Chat.event_seq).where(Chat.id == chat_id))).scalar_one_or_none()
+        if current_seq is None:
+            # Чат удалён, пока клиент был отключён
+            return None, [], False
+        # События, закоммиченные после чтения current_seq, клиент получит вживую
+        result = await db.execute(
+            select(Message, func.concat(User.first_name, ' ', User.last_name))
+            .join(User, User.id == Message.sender_id)
+            .where(Message.chat_id == chat_id, event_seq > last_seq, event_seq <= current_seq)
+            .order_by(event_seq)
+            .limit(limit + 1)
+        )
+        rows = result.all()
+    events = []
+    covered = 0
+    for message, sender_name in rows:
+        if message.deleted_at is not None:
+            event_type, seq, data = "message.deleted", message.deleted_seq, {"message_id": message.id}
+            # Tombstone заменяет и событие создания, если оно тоже попало в пропуск
+            covered += 2 if message.seq > last_seq else 1
+        else:
+            event_type, seq, data = "message.created", message.seq, {"message": serialize_message(message, sender_name)}
+            covered += 1
+        events.append(jsonable_encoder({"type": event_type, "chat_id": chat_id, "seq": seq, "data": data}))
+    complete = len(rows) <= limit and covered == max(current_seq - last_seq, 0)
+    return current_seq, events, complete
+
+
+async def resume_chat(connection: ClientConnection, chat_id: str, last_seq: int):
+    # Досылаются только события, которых не хватает клиенту; если пропуск не помещается
+    # в очередь отправки, клиенту предлагается перезагрузить историю целиком
+    capacity = connection.queue.maxsize - connection.queue.qsize() - 1
+    events = replay_buffer.events_after(chat_id, last_seq)
+    source = "buffer"
+    current_seq = events[-1]["seq"] if events else last_seq
+    complete = True
+    if events is None:
+        source = "database"
+        current_seq, events, complete = await load_missed_events(chat_id, last_seq, capacity)
+        if current_seq is None:
+            registry.unsubscribe(connection, chat_id)
+            connection.enqueue({"type": "error", "chat_id": chat_id, "detail": "Чат не найден"})
+            return
+    ws_replays.inc(source=source)
+    # Пропуск в seq значит, что восстановить можно не все события, и "resumed" был бы неправдой
+    if len(events) > capacity or not complete:
+        connection.enqueue({"type": "resync.required", "chat_id": chat_id, "seq": current_seq})
+        return
+    for event in events:
+        connection.enqueue(event)
+    connection.enqueue({"type": "resumed", "chat_id": chat_id, "seq": current_seq, "source": source})
+
+
+async def handle_project_frame(connection: ClientConnection, current_user: CurrentUser, action: str, project_id):
+    try:
+        project_id = str(UUID(str(project_id)))
+    except ValueError:
+        connection.enqueue({"type": "error", "detail": "Некорректный project_id"})
+        return
+    if action == "unsubscribe":
+        registry.unsubscribe(connection, project_key(project_id))
+        connection.enqueue({"type": "unsubscribed", "project_id": project_id})
+        return
+    if not await is_project_member(current_user.id, project_id):
+        connection.enqueue({"type": "error", "project_id": project_id, "detail": "Вы не являетесь участником этого проекта"})
+        return
+    registry.subscribe(connection, project_key(project_id))
+    connection.enqueue({"type": "subscribed", "project_id": project_id})
+
+
+async def handle_client_frame(connection: ClientConnection, current_user: CurrentUser, frame: dict):
+    action = frame.get("action")
+    chat_id = frame.get("chat_id")
+    project_id = frame.get("project_id")
+
+    if action == "pong":
+        return
+    if action in ("subscribe", "unsubscribe") and project_id:
+        await handle_project_frame(connection, current_user, action, project_id)
+    elif action == "subscribe" and chat_id:
+        try:
+            chat_id = str(UUID(str(chat_id)))
+        except ValueError:
+            connection.enqueue({"type": "error", "detail": "Некорректный chat_id"})
+            return
+        if not await get_user_chat_ids(current_user.id, chat_id):
+            connection.enqueue({"type": "error", "chat_id": chat_id, "detail": "Вы не являетесь участником этого чата"})
+            return
+        registry.subscribe(connection, chat_id)
+        connection.enqueue({"type": "subscribed", "chat_id": chat_id})
+    elif action == "resume" and chat_id:
+        last_seq = frame.get("last_seq")
+        try:
+            chat_id = str(UUID(str(chat_id)))
+        except ValueError:
+            connection.enqueue({"type": "error", "detail": "Некорректный chat_id"})
+            return
+        if not isinstance(last_seq, int) or last_seq < 0:
+            connection.enqueue({"type": "error", "chat_id": chat_id, "detail": "Некорректный last_seq"})
+            return
+        if chat_id not in connection.chats and not await get_user_chat_ids(current_user.id, chat_id):
+            connection.enqueue({"type": "error", "chat_id": chat_id, "detail": "Вы не являетесь участником этого чата"})
+            return
+        await resume_chat(connection, chat_id, last_seq)
+    elif action == "unsubscribe" and chat_id:
+        registry.unsubscribe(connection, str(chat_id))
+        connection.enqueue({"type": "unsubscribed", "chat_id": str(chat_id)})
+    else:
+        connection.enqueue({"type": "error", "detail": "Неизвестное действие"})
+
+
+@router.websocket("/ws")
+async def multiplexed_websocket_endpoint(websocket: WebSocket, token: str = ""):
+    # Один сокет на пользователя: токен тот же, что и для HTTP, подписка сразу на все его чаты
+    try:
+        async with async_session() as db:
+            current_user = await authenticate_token(db, token)
+    except HTTPException:
+        await websocket.close(code=POLICY_VIOLATION_CLOSE_CODE)
+        return
+
+    await websocket.accept()
+    user_id = str(current_user.id)
+    logger.info(f"WebSocket connection established for user_id: {user_id}")
+
+    connection = ClientConnection(websocket, user_id=user_id, heartbeat=True)
+    registry.register(connection)
+    for chat_id in await get_user_chat_ids(current_user.id):
+        registry.subscribe(connection, chat_id)
+    connection.start()
+
+    try:
+        while True:
+            data = await websocket.receive_text()
+            connection.touch()
+            try:
+                frame = json.loads(data)
+            except ValueError:
+                frame = None
+            if not isinstance(frame, dict):
+                connection.enqueue({"type": "error", "detail": "Ожидается JSON-объект"})
+                continue
+            try:
+                await handle_client_frame(connection, current_user, frame)
+            except Exception as e:
+                # Ошибка одного кадра не должна закрывать сокет со всеми подписками пользователя
+                logger.error(f"Error handling WebSocket frame of user_id {user_id}: {e}")
+                connection.enqueue({"type": "error", "detail": "Не удалось обработать запрос"})
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket connection closed for user_id: {user_id}")
+    finally:
+        registry.unregister(connection)
+        await connection.close()
+
+
+# Соединение на один чат без авторизации, оставлено для совместимости с текущим клиентом:
+# только уведомления в старом формате, без текста сообщений
 @router.websocket("/ws/chat/{chat_id}")
 async def websocket_endpoint(websocket: WebSocket, chat_id: str):
+    # Только id чата: иначе путь мог бы указать на ключ реестра project:<id>
+    try:
+        chat_id = str(UUID(chat_id))
+    except ValueError:
+        await websocket.close(code=POLICY_VIOLATION_CLOSE_CODE)
+        return
     logger.info(f"WebSocket connection established for chat_id: {chat_id}")
     await websocket.accept()
 
-    if chat_id not in active_connections:
-        active_connections[chat_id] = []
-    active_connections[chat_id].append(websocket)
-
-    logger.info(f"Active connections: {active_connections}")
+    connection = ClientConnection(websocket, legacy=True)
+    registry.register(connection)
+    registry.subscribe(connection, chat_id)
+    connection.start()
 
     try:
         while True:
             data = await websocket.receive_text()
-            logger.info(f"Received message from chat_id {chat_id}: {data}")
+            logger.debug(f"Received message from chat_id {chat_id}: {data}")
     except WebSocketDisconnect:
         logger.info(f"WebSocket connection closed for chat_id: {chat_id}")
-        active_connections[chat_id].remove(websocket)
-        if not active_connections[chat_id]:
-            del active_connections[chat_id]
+    finally:
+        registry.unregister(connection)
+        await connection.close()
 
 
-async def notify_clients_about_new_message(chat_id: str):
-    logger.info(f"Notifying clients for chat_id: {chat_id}")
-    if chat_id in active_connections:
-        for connection in active_connections[chat_id]:
-            try:
-                await connection.send_text("New message received")
-                logger.debug(f"Notification sent to client in chat_id: {chat_id}")
-            except Exception as e:
-                logger.error(f"Error sending notification to client: {e}")
-                active_connections[chat_id].remove(connection)
-                if not active_connections[chat_id]:
-                    del active_connections[chat_id]
-    else:
-        logger.warning(f"No active connections found for chat_id: {chat_id}")
+async def publish_chat_event(chat_id, seq: int, event_type: str, data: dict):
+    # Событие содержит все данные для применения на клиенте без повторного запроса истории;
+    # seq монотонно растёт в пределах чата и позволяет клиенту обнаружить пропуски
+    event = jsonable_encoder({
+        "type": event_type,
+        "chat_id": chat_id,
+        "seq": seq,
+        "data": data,
+    })
+    logger.info(f"Publishing {event_type} #{seq} for chat_id: {event['chat_id']}")
+    try:
+        try:
+            await broadcast.publish(CHAT_EVENTS_TOPIC, event)
+        except PayloadTooLarge:
+            # Слишком большое событие заменяется уведомлением без данных, клиент дозапросит его сам
+            await broadcast.publish(CHAT_EVENTS_TOPIC, {**event, "data": None, "truncated": True})
+    except Exception as e:
+        # Пропуск seq клиент обнаружит на следующем событии и дозапросит историю
+        record_publish_failure(CHAT_EVENTS_TOPIC, e)
 
 
-async def notify_clients_about_message_deletion(chat_id: str, message_id: str):
-    logger.info(f"Notifying clients about deletion of message with id: {message_id} in chat_id: {chat_id}")
-    if chat_id in active_connections:
-        for connection in active_connections[chat_id]:
-            try:
-                await connection.send_json({
-                    "action": "delete",
-                    "message_id": message_id  # Передаем ID удаленного сообщения
-                })
-                logger.debug(f"Deletion notification sent to client in chat_id: {chat_id}")
-            except Exception as e:
-                logger.error(f"Error sending deletion notification to client: {e}")
-                active_connections[chat_id].remove(connection)
-                if not active_connections[chat_id]:
-                    del active_connections[chat_id]
-    else:
-        logger.warning(f"No active connections found for chat_id: {chat_id}")
\ No newline at end of file
+async def deliver_chat_event(event: dict):
+    if event["type"] == "participant.added" and event.get("data"):
+        # Новый участник сразу получает события чата на уже открытых сокетах
+        registry.subscribe_user(event["data"]["user_id"], event["chat_id"])
+    replay_buffer.append(event)
+    registry.fan_out(event["chat_id"], event)
+
+
+broadcast.subscribe(CHAT_EVENTS_TOPIC, deliver_chat_event)
+
+
+async def publish_project_event(project_id, event_type: str, data: dict):
+    # Изменения доски без seq и буфера: после переподключения клиент заново загружает доску
+    event = jsonable_encoder({
+        "type": event_type,
+        "project_id": project_id,
+        "data": data,
+    })
+    logger.info(f"Publishing {event_type} for project_id: {event['project_id']}")
+    try:
+        try:
+            await broadcast.publish(PROJECT_EVENTS_TOPIC, event)
+        except PayloadTooLarge:
+            await broadcast.publish(PROJECT_EVENTS_TOPIC, {**event, "data": None, "truncated": True})
+    except Exception as e:
+        record_publish_failure(PROJECT_EVENTS_TOPIC, e)
+
+
+async def deliver_project_event(event: dict):
+    registry.fan_out(project_key(event["project_id"]), event)
+
+
+broadcast.subscribe(PROJECT_EVENTS_TOPIC, deliver_project_event)
@@ -0,0 +1,172 @@
+import asyncio
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+
+import settings
+from database import engine as primary_engine
+from logsHandle import logger
+
+# Сколько текстов запросов хранить для отладки N+1 в одном запросе
+MAX_RECORDED_STATEMENTS = 50
+SERVER_TIMING_PATTERN = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+class QueryStats:
+    def __init__(self, route: Optional[str] = None, scope: Optional[dict] = None):
+        self.path = route
+        # Маршрут появляется в scope, когда роутер выбрал эндпоинт, то есть до первого запроса к базе
+        self.scope = scope
+        self.count = 0
+        self.duration = 0.0
+        self.statements: List[str] = []
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        if len(self.statements) < MAX_RECORDED_STATEMENTS:
+            self.statements.append(statement)
+
+    @property
+    def route(self) -> Optional[str]:
+        # Шаблон маршрута вместо пути: /tasks/project/{project_id} группирует запросы ко всем проектам
+        route = self.scope.get("route") if self.scope is not None else None
+        return getattr(route, "path", None) or self.path
+
+
+# Статистика текущего HTTP-запроса; контекст переходит и в greenlet, в котором SQLAlchemy выполняет запросы
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+
+
+# Слушатели на классе Engine действуют на основной движок и движки реплик
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    duration = time.perf_counter() - started
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.record(statement, duration)
+    if duration * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+        # EXPLAIN ANALYZE выполняет запрос, поэтому план снимается только для чтений
+        writes = context is not None and (context.isinsert or context.isupdate or context.isdelete)
+        explainable = not (executemany or writes)
+        slow_query_log.record(statement, parameters, duration, stats.route if stats is not None else None, explainable)
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(exception_context):
+    # Упавший запрос не доходит до after_cursor_execute; без этого время старта оставалось бы в стеке соединения
+    connection = exception_context.connection
+    if connection is not None and exception_context.execution_context is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+def parameter_shape(value) -> str:
+    # В журнал попадают только типы и размеры параметров, без значений
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+
+class SlowQueryLog:
+    # Последние медленные запросы воркера. Для части SELECT план EXPLAIN (ANALYZE, BUFFERS)
+    # снимается отдельно на основной базе, по одному за раз, чтобы не добавлять нагрузки
+    def __init__(self, size: int):
+        self.entries: deque = deque(maxlen=size)
+        self.explain_task: Optional[asyncio.Task] = None
+
+    def record(self, statement: str, parameters, duration: float, route: Optional[str], explainable: bool = True):
+        if statement.lstrip().upper().startswith("EXPLAIN"):
+            return
+        if isinstance(parameters, dict):
+            shapes = {key: parameter_shape(value) for key, value in parameters.items()}
+        else:
+            shapes = [parameter_shape(value) for value in parameters or ()]
+        entry = {
+            "recorded_at": datetime.now(timezone.utc),
+            "route": route,
+            "duration_ms": round(duration * 1000, 1),
+            "statement": statement,
+            "parameters": shapes,
+            "plan": None,
+        }
+        self.entries.append(entry)
+        logger.warning(f"Slow query ({entry['duration_ms']} ms) on {route}: {statement}")
+
+        if (
+            explainable
+            and statement.lstrip().upper().startswith(("SELECT", "WITH"))
+            and random.random() < settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE
+            and (self.explain_task is None or self.explain_task.done())
+        ):
+            try:
+                self.explain_task = asyncio.get_running_loop().create_task(self.explain(entry, statement, parameters))
+            except RuntimeError:
+                pass
+
+    async def explain(self, entry: dict, statement: str, parameters):
+        try:
+            async with primary_engine.connect() as connection:
+                # ANALYZE выполняет запрос, поэтому транзакция только для чтения и откатывается
+                await connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+                result = await connection.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+                entry["plan"] = "\n".join(row[0] for row in result)
+                await connection.rollback()
+        except Exception as e:
+            entry["plan"] = f"EXPLAIN failed: {e}"
+
+    def latest(self, limit: int) -> List[dict]:
+        return list(self.entries)[::-1][:limit]
+
+
+slow_query_log = SlowQueryLog(settings.SLOW_QUERY_LOG_SIZE)
+
+
+@contextmanager
+def track_queries(route: Optional[str] = None, scope: Optional[dict] = None):
+    stats = QueryStats(route, scope)
+    token = current_query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_query_stats.reset(token)
+
+
+async def query_stats_middleware(request: Request, call_next):
+    with track_queries(request.url.path, request.scope) as stats:
+        response = await call_next(request)
+    duration_ms = stats.duration * 1000
+    response.headers.append("Server-Timing", f'db;dur={duration_ms:.1f};desc="{stats.count} queries"')
+    message = f"{request.method} {stats.route}: {stats.count} queries, {duration_ms:.1f} ms in database"
+    if stats.count > settings.QUERY_COUNT_WARNING:
+        logger.warning(message)
+    else:
+        logger.debug(message)
+    return response
+
+
+def assert_query_budget(source, budget: int):
+    # Для тестов: source - QueryStats из track_queries() или ответ TestClient с заголовком Server-Timing
+    if isinstance(source, QueryStats):
+        count, statements = source.count, source.statements
+    else:
+        match = SERVER_TIMING_PATTERN.search(source.headers.get("server-timing", ""))
+        assert match is not None, "В ответе нет заголовка Server-Timing со статистикой запросов"
+        count, statements = int(match.group(1)), []
+    assert count <= budget, f"Выполнено {count} SQL-запросов при бюджете {budget}:\n" + "\n".join(statements)
@@ -0,0 +1,112 @@
+import asyncio
+from typing import List, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session
+from logsHandle import logger
+from metrics import Counter
+from models import Task
+
+# Цифры ключа в порядке ASCII, поэтому ключи сравниваются как строки с collation "C".
+# Ключ никогда не заканчивается на "0": между любыми двумя ключами всегда найдётся третий
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+
+
+def rank_between(lower: Optional[str], upper: Optional[str]) -> str:
+    # Ключ строго между lower и upper; None означает начало или конец колонки
+    if lower is not None and upper is not None and lower >= upper:
+        raise ValueError("lower must be less than upper")
+    prefix = lower or ""
+    result = []
+    position = 0
+    bounded = upper is not None
+    while True:
+        low = DIGITS.index(prefix[position]) if position < len(prefix) else 0
+        high = DIGITS.index(upper[position]) if bounded and position < len(upper) else BASE
+        if low == high:
+            result.append(DIGITS[low])
+        elif high - low > 1:
+            # У краёв колонки шаг на одну цифру, а не середина: ключи растут медленнее
+            if upper is None:
+                digit = low + 1
+            elif lower is None:
+                digit = high - 1
+            else:
+                digit = (low + high) // 2
+            result.append(DIGITS[digit])
+            return "".join(result)
+        else:
+            # Соседние цифры: берём меньшую, дальше ключ уже меньше upper при любом продолжении
+            result.append(DIGITS[low])
+            bounded = False
+        position += 1
+
+
+def spaced_ranks(count: int) -> List[str]:
+    # Равномерно расставленные ключи минимальной длины для count задач
+    width = 1
+    while BASE ** width <= count:
+        width += 1
+    step = BASE ** width // (count + 1)
+    ranks = []
+    for index in range(1, count + 1):
+        value = index * step
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, BASE)
+            digits.append(DIGITS[digit])
+        ranks.append("".join(reversed(digits)).rstrip(DIGITS[0]))
+    return ranks
+
+
+async def rebalance_column(db: AsyncSession, project_id: UUID, status_id: UUID):
+    # Переписывает ключи колонки, сохраняя порядок; строки блокируются до конца транзакции
+    result = await db.execute(
+        select(Task.id)
+        .where(Task.project_id == project_id, Task.status_id == status_id)
+        .order_by(Task.rank, Task.id)
+        .with_for_update()
+    )
+    task_ids = result.scalars().all()
+    if not task_ids:
+        return
+    await db.execute(
+        update(Task),
+        [{"id": task_id, "rank": rank} for task_id, rank in zip(task_ids, spaced_ranks(len(task_ids)))],
+    )
+    rank_rebalances.inc()
+
+
+class RankRebalancer:
+    # Перебалансировка колонки после того, как ключи стали слишком длинными, в фоне вне запроса
+    def __init__(self):
+        self.pending: Set[Tuple[UUID, UUID]] = set()
+        self.tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, project_id: UUID, status_id: UUID):
+        key = (project_id, status_id)
+        if key in self.pending:
+            return
+        self.pending.add(key)
+        task = asyncio.create_task(self.run(key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, key: Tuple[UUID, UUID]):
+        try:
+            async with async_session() as db:
+                await rebalance_column(db, *key)
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Error rebalancing task ranks for project_id {key[0]}, status_id {key[1]}: {e}")
+        finally:
+            self.pending.discard(key)
+
+
+rank_rebalances = Counter("welt_task_rank_rebalances_total", "Task columns renumbered to shorten rank keys")
+
+rank_rebalancer = RankRebalancer()
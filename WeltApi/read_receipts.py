@@ -0,0 +1,113 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, Tuple, Optional
+from uuid import UUID
+
+from sqlalchemy import bindparam, select, func, or_, tuple_, DateTime
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+
+import settings
+from database import async_session
+from logsHandle import logger
+from models import ChatParticipant, Message
+
+participants_table = ChatParticipant.__table__
+messages_table = Message.__table__
+
+read_at_param = bindparam("b_read_at", type_=DateTime)
+message_id_param = bindparam("b_message_id", type_=PG_UUID)
+
+# Количество непрочитанных считается только по хвосту чата после курсора (индекс chat_id, sent_at, id)
+unread_after_cursor = (
+    select(func.count())
+    .select_from(messages_table)
+    .where(
+        messages_table.c.chat_id == participants_table.c.chat_id,
+        messages_table.c.sender_id != participants_table.c.user_id,
+        messages_table.c.deleted_at.is_(None),
+        tuple_(messages_table.c.sent_at, messages_table.c.id) > tuple_(read_at_param, message_id_param)
+    )
+    .scalar_subquery()
+)
+
+# Курсор только сдвигается вперёд: устаревшие отметки из других вкладок игнорируются
+mark_read_statement = (
+    participants_table.update()
+    .where(
+        participants_table.c.chat_id == bindparam("b_chat_id", type_=PG_UUID),
+        participants_table.c.user_id == bindparam("b_user_id", type_=PG_UUID),
+        or_(
+            participants_table.c.last_read_at.is_(None),
+            tuple_(participants_table.c.last_read_at, participants_table.c.last_read_message_id)
+            < tuple_(read_at_param, message_id_param)
+        )
+    )
+    .values(
+        last_read_at=read_at_param,
+        last_read_message_id=message_id_param,
+        unread_count=unread_after_cursor
+    )
+)
+
+
+class ReadReceiptBuffer:
+    # Write-behind буфер отметок о прочтении: на каждую пару (чат, пользователь)
+    # хранится только самый дальний курсор, в базу всё уходит одним executemany по таймеру
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[UUID, UUID], Tuple[datetime, UUID]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def mark_read(self, chat_id: UUID, user_id: UUID, sent_at: datetime, message_id: UUID):
+        key = (chat_id, user_id)
+        current = self._pending.get(key)
+        if current is None or (sent_at, message_id) > current:
+            self._pending[key] = (sent_at, message_id)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+
+        params = [
+            {
+                "b_chat_id": chat_id,
+                "b_user_id": user_id,
+                "b_read_at": sent_at,
+                "b_message_id": message_id,
+            }
+            for (chat_id, user_id), (sent_at, message_id) in pending.items()
+        ]
+        try:
+            async with async_session() as session:
+                await session.execute(mark_read_statement, params)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error flushing read receipts: {e}")
+            # Возвращаем отметки в буфер, не затирая более свежие
+            for (chat_id, user_id), (sent_at, message_id) in pending.items():
+                self.mark_read(chat_id, user_id, sent_at, message_id)
+            return
+        logger.debug(f"Flushed {len(params)} read receipts")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+read_receipts = ReadReceiptBuffer(settings.READ_RECEIPTS_FLUSH_INTERVAL)
@@ -0,0 +1,127 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from uuid import UUID, uuid4
+
+from sqlalchemy import select
+
+import settings
+from broadcast import broadcast, record_publish_failure
+from database import async_session
+from logsHandle import logger
+from metrics import Counter, Gauge
+from models import Role, RequestStatus, TaskStatus, TaskPriority
+
+REFERENCE_INVALIDATIONS_TOPIC = "reference_invalidations"
+# Свои сообщения воркер пропускает: он перечитал справочник ещё до публикации
+WORKER_ID = uuid4().hex
+
+
+@dataclass(frozen=True)
+class Reference:
+    id: UUID
+    title: str
+
+
+class ReferenceTable:
+    # Маленький справочник целиком в памяти воркера: поиск по id и по названию без запросов к базе
+    def __init__(self, name: str, model):
+        self.name = name
+        self.model = model
+        self.items: List[Reference] = []
+        self.by_id: Dict[UUID, Reference] = {}
+        self.by_title: Dict[str, Reference] = {}
+        # Параллельные перезагрузки не должны перезаписать свежие данные устаревшими
+        self._lock = asyncio.Lock()
+
+    async def reload(self):
+        async with self._lock:
+            async with async_session() as session:
+                result = await session.execute(select(self.model.id, self.model.title))
+                items = [Reference(id=row.id, title=row.title) for row in result]
+            self.items = items
+            self.by_id = {item.id: item for item in items}
+            self.by_title = {item.title: item for item in items}
+        reference_reloads.inc()
+
+    def get(self, item_id: UUID) -> Optional[Reference]:
+        return self.by_id.get(item_id)
+
+    def get_by_title(self, title: str) -> Optional[Reference]:
+        return self.by_title.get(title)
+
+    def all(self) -> List[Reference]:
+        return list(self.items)
+
+
+reference_reloads = Counter("welt_reference_reloads_total", "Reloads of reference tables")
+
+roles = ReferenceTable("roles", Role)
+request_statuses = ReferenceTable("request_statuses", RequestStatus)
+task_statuses = ReferenceTable("task_statuses", TaskStatus)
+task_priorities = ReferenceTable("task_priorities", TaskPriority)
+
+tables = {table.name: table for table in (roles, request_statuses, task_statuses, task_priorities)}
+
+Gauge(
+    "welt_reference_entries",
+    "Entries in the reference tables cache",
+    function=lambda: sum(len(table.items) for table in tables.values()),
+)
+
+
+async def load_reference_data():
+    await asyncio.gather(*(table.reload() for table in tables.values()))
+
+
+class ReferenceReloader:
+    # Периодическая перезагрузка страхует от пропущенных сообщений broadcast
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await load_reference_data()
+            except Exception as e:
+                logger.error(f"Error reloading reference tables: {e}")
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+reference_reloader = ReferenceReloader(settings.REFERENCE_RELOAD_INTERVAL)
+
+
+async def invalidate_reference(table: ReferenceTable):
+    # Текущий воркер видит изменение сразу после ответа, остальные — по broadcast
+    await table.reload()
+    try:
+        await broadcast.publish(REFERENCE_INVALIDATIONS_TOPIC, {"table": table.name, "origin": WORKER_ID})
+    except Exception as e:
+        record_publish_failure(REFERENCE_INVALIDATIONS_TOPIC, e)
+
+
+async def apply_reference_invalidation(message: dict):
+    if message.get("origin") == WORKER_ID:
+        return
+    table = tables.get(message.get("table"))
+    if table is None:
+        logger.warning(f"Unknown reference table in invalidation: {message}")
+        return
+    await table.reload()
+
+
+broadcast.subscribe(REFERENCE_INVALIDATIONS_TOPIC, apply_reference_invalidation)
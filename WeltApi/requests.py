@@ -7,6 +7,7 @@ from sqlalchemy import select, and_, or_
 from auth import get_current_user
 from database import db_dependency
 from models import User, RequestStatus, Request, Chat, ChatParticipant
+from reference_data import request_statuses
 from starlette import status
 
 router = APIRouter(
@@ -41,9 +42,7 @@ async def create_request(
             detail="Пользователь-получатель не найден"
         )
 
-    status_query = select(RequestStatus).where(RequestStatus.title == "IN PROGRESS")
-    status_result = await db.execute(status_query)
-    request_status = status_result.scalar_one_or_none()
+    request_status = request_statuses.get_by_title("IN PROGRESS")
     if not request_status:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -305,9 +304,7 @@ async def update_request_status(
             detail="Заявка не найдена или у вас нет доступа к ней"
         )
 
-    status_query = select(RequestStatus).where(RequestStatus.title == new_status_title)
-    status_result = await db.execute(status_query)
-    new_status = status_result.scalar_one_or_none()
+    new_status = request_statuses.get_by_title(new_status_title)
 
     if not new_status:
         raise HTTPException(
@@ -12,6 +12,24 @@ REAL_DATABASE_URL = env.str(
     default=f"postgresql+asyncpg://postgres:postgres@db:5432/postgres"
 )
 
+# Пул соединений SQLAlchemy: размер с overflow на воркер нужно умножать на число воркеров
+# и сверять с max_connections в Postgres. DB_COMMAND_TIMEOUT в секундах, 0 - без ограничения;
+# DB_STATEMENT_CACHE_SIZE=0 нужен за pgbouncer в режиме transaction
+DB_POOL_SIZE = env.int("DB_POOL_SIZE", default=10)
+DB_MAX_OVERFLOW = env.int("DB_MAX_OVERFLOW", default=10)
+DB_POOL_TIMEOUT = env.float("DB_POOL_TIMEOUT", default=30.0)
+DB_POOL_RECYCLE = env.int("DB_POOL_RECYCLE", default=1800)
+DB_POOL_PRE_PING = env.bool("DB_POOL_PRE_PING", default=True)
+DB_STATEMENT_CACHE_SIZE = env.int("DB_STATEMENT_CACHE_SIZE", default=100)
+DB_COMMAND_TIMEOUT = env.float("DB_COMMAND_TIMEOUT", default=60.0)
+DB_ECHO = env.bool("DB_ECHO", default=False)
+
+# Реплики для GET-запросов (через запятую). Реплика с отставанием больше REPLICA_MAX_LAG_SECONDS
+# или не ответившая на проверку исключается до следующей проверки, чтения идут на основную базу
+REPLICA_DATABASE_URLS = env.list("REPLICA_DATABASE_URLS", default=[])
+REPLICA_MAX_LAG_SECONDS = env.float("REPLICA_MAX_LAG_SECONDS", default=5.0)
+REPLICA_HEALTH_CHECK_INTERVAL = env.float("REPLICA_HEALTH_CHECK_INTERVAL", default=5.0)
+
 BASE_URL = env.str(
     "BASE_URL",
     default="http://176.124.212.130:8000"
@@ -24,5 +42,55 @@ ALGORITHM = "HS256"
 JWT_SECRET_KEY = env.str('JWT_SECRET_KEY', default='49b23e9824c806747eca0217ed33a5b0327031cd4399db5805bed4e8ee5f7254619c3e08b21ae5cb93ef5313b02a6f5abf8a9298c205148337c9f3276f035200')
 JWT_REFRESH_SECRET_KEY = env.str('JWT_REFRESH_SECRET_KEY', default='49b23e9824c806747eca0217ed33a5b0327031cd4399db5805bed4e8ee5f7254619c3e08b21ae5cb93ef5313b02a6f5abf8a9298c205148337c9f3276f035200')
 
+READ_RECEIPTS_FLUSH_INTERVAL = env.float("READ_RECEIPTS_FLUSH_INTERVAL", default=2.0)
+
+# Бэкенд рассылки событий между воркерами: memory (один процесс) или postgres (LISTEN/NOTIFY)
+BROADCAST_BACKEND = env.str("BROADCAST_BACKEND", default="memory")
+BROADCAST_CHANNEL = env.str("BROADCAST_CHANNEL", default="welt_events")
+
+# Исходящая очередь каждого WebSocket-соединения и поведение при её переполнении:
+# drop_oldest - выбрасывать самые старые события, disconnect - отключать медленного клиента
+WS_SEND_QUEUE_SIZE = env.int("WS_SEND_QUEUE_SIZE", default=100)
+WS_OVERFLOW_POLICY = env.str("WS_OVERFLOW_POLICY", default="drop_oldest")
+WS_SEND_TIMEOUT = env.float("WS_SEND_TIMEOUT", default=10.0)
+
+# Heartbeat мультиплексированного сокета: сервер шлёт ping раз в интервал
+# и отключает клиента, от которого ничего не приходило дольше интервала и таймаута
+WS_PING_INTERVAL = env.float("WS_PING_INTERVAL", default=20.0)
+WS_PING_TIMEOUT = env.float("WS_PING_TIMEOUT", default=10.0)
+
+# Буфер последних событий каждого чата для досылки после переподключения;
+# чатов в памяти не больше WS_REPLAY_MAX_CHATS, давно неактивные вытесняются
+WS_REPLAY_BUFFER_SIZE = env.int("WS_REPLAY_BUFFER_SIZE", default=50)
+WS_REPLAY_MAX_CHATS = env.int("WS_REPLAY_MAX_CHATS", default=1000)
+
+# Кэш пользователей, найденных по токену: TTL в секундах и максимальное число записей в воркере.
+# PRINCIPAL_CACHE_BROADCAST рассылает сбросы кэша остальным воркерам через broadcast
+PRINCIPAL_CACHE_TTL = env.float("PRINCIPAL_CACHE_TTL", default=30.0)
+PRINCIPAL_CACHE_SIZE = env.int("PRINCIPAL_CACHE_SIZE", default=10000)
+PRINCIPAL_CACHE_BROADCAST = env.bool("PRINCIPAL_CACHE_BROADCAST", default=True)
+
+# Токены доступа с id, ролью и версией пользователя: проверка прав без запроса к базе.
+# Версия токена сверяется с users.token_version через кэш с TTL TOKEN_VERSION_CACHE_TTL секунд
+STATELESS_AUTH = env.bool("STATELESS_AUTH", default=False)
+TOKEN_VERSION_CACHE_TTL = env.float("TOKEN_VERSION_CACHE_TTL", default=30.0)
+
+# Пул потоков для bcrypt: число потоков и сколько запросов может ждать, прежде чем сервер ответит 503
+PASSWORD_HASH_WORKERS = env.int("PASSWORD_HASH_WORKERS", default=2)
+PASSWORD_HASH_QUEUE_SIZE = env.int("PASSWORD_HASH_QUEUE_SIZE", default=32)
+
+# Запросы, выполнившие больше SQL-запросов, пишутся в лог с уровнем WARNING
+QUERY_COUNT_WARNING = env.int("QUERY_COUNT_WARNING", default=20)
+
+# Журнал медленных запросов: порог в миллисекундах, размер журнала в воркере
+# и доля медленных SELECT, для которых снимается EXPLAIN (ANALYZE, BUFFERS)
+SLOW_QUERY_THRESHOLD_MS = env.float("SLOW_QUERY_THRESHOLD_MS", default=200.0)
+SLOW_QUERY_LOG_SIZE = env.int("SLOW_QUERY_LOG_SIZE", default=200)
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = env.float("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", default=0.1)
 
+# Справочники перечитываются целиком раз в интервал на случай потерянной инвалидации
+# или правки в базе в обход API; 0 отключает периодическую перезагрузку
+REFERENCE_RELOAD_INTERVAL = env.float("REFERENCE_RELOAD_INTERVAL", default=300.0)
 
+# Колонка доски перенумеровывается в фоне, когда ключ перемещённой задачи длиннее этого значения
+TASK_RANK_REBALANCE_LENGTH = env.int("TASK_RANK_REBALANCE_LENGTH", default=12)
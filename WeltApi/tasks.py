@@ -1,30 +1,43 @@
 import uuid
+from collections import defaultdict, namedtuple
 from datetime import datetime, timezone
-from typing import Optional, List
+from typing import Optional, List, Dict
 
-from fastapi import APIRouter, HTTPException, status, Depends, Form
+from fastapi import APIRouter, HTTPException, status, Depends, Form, Query
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import select, func, tuple_, update, delete, any_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from auth import get_current_user
-from database import db_dependency
+from auth import get_current_user, ensure_role
+from database import db_dependency, read_db_dependency
 from models import TaskStatus, TaskPriority, Task, User, TaskAssignment, Project
-from settings import BASE_URL
+from my_websockets import publish_project_event
+from ranking import rank_between, rebalance_column, rank_rebalancer
+from reference_data import task_statuses, task_priorities, invalidate_reference
+from settings import BASE_URL, TASK_RANK_REBALANCE_LENGTH
+from utils import encode_cursor, decode_cursor
 
 router = APIRouter(
     prefix='/tasks',
     tags=['tasks']
 )
 
+BOARD_COLUMN_MAX_LIMIT = 200
+BULK_TASKS_MAX_SIZE = 500
+# Ограничивает число строк в одной вставке task_assignments: задачи x исполнители
+BULK_ASSIGNEES_MAX_SIZE = 20
+
+TASK_DELETE_ROLES = ["ADMIN", "MODERATOR"]
+
+TaskRank = namedtuple("TaskRank", ["id", "rank"])
+
 class CreateTitleRequest(BaseModel):
     title: str
 
 @router.post('/create-task-status', summary="Создание нового статуса задачи")
 async def create_task_status(db: db_dependency, data: CreateTitleRequest):
-    query = select(TaskStatus).where(TaskStatus.title == data.title)
-    result = await db.execute(query)
-    task_status = result.scalar_one_or_none()
-    if task_status is not None:
+    if task_statuses.get_by_title(data.title) is not None:
             raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Статус задачи с таким названием уже есть в базе данных"
@@ -35,6 +48,7 @@ async def create_task_status(db: db_dependency, data: CreateTitleRequest):
     db.add(task_status)
     await db.commit()
     await db.refresh(task_status)
+    await invalidate_reference(task_statuses)
 
 
 class CreateTaskRequest(BaseModel):
@@ -46,6 +60,17 @@ class CreateTaskRequest(BaseModel):
     deadline: Optional[datetime] = None
     assignee_ids: Optional[List[uuid.UUID]] = []
 
+async def validate_assignees(db: AsyncSession, user_ids: List[uuid.UUID]) -> List[uuid.UUID]:
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return user_ids
+    result = await db.execute(select(User.id).where(User.id.in_(user_ids)))
+    found = set(result.scalars().all())
+    for user_id in user_ids:
+        if user_id not in found:
+            raise HTTPException(status_code=404, detail=f"Пользователь {user_id} не найден")
+    return user_ids
+
 @router.post("/create")
 async def create_task(
     request: CreateTaskRequest,
@@ -59,17 +84,16 @@ async def create_task(
         raise HTTPException(status_code=404, detail="Проект не найден")
 
     # Проверка: существует ли статус
-    status_result = await db.execute(select(TaskStatus).where(TaskStatus.id == request.status_id))
-    status_obj = status_result.scalar_one_or_none()
-    if not status_obj:
+    if task_statuses.get(request.status_id) is None:
         raise HTTPException(status_code=404, detail="Статус задачи не найден")
 
     # Проверка: существует ли приоритет
-    priority_result = await db.execute(select(TaskPriority).where(TaskPriority.id == request.priority_id))
-    priority_obj = priority_result.scalar_one_or_none()
-    if not priority_obj:
+    if task_priorities.get(request.priority_id) is None:
         raise HTTPException(status_code=404, detail="Приоритет задачи не найден")
 
+    # Проверка: существуют ли исполнители, до создания задачи
+    assignee_ids = await validate_assignees(db, request.assignee_ids or [])
+
     deadline = request.deadline.astimezone(timezone.utc).replace(tzinfo=None)
     # Создаём задачу
     new_task = Task(
@@ -78,78 +102,161 @@ async def create_task(
         project_id=request.project_id,
         status_id=request.status_id,
         priority_id=request.priority_id,
-        deadline=deadline
+        deadline=deadline,
+        rank=await rank_at_end(db, request.project_id, request.status_id)
     )
     db.add(new_task)
-    await db.commit()
-    await db.refresh(new_task)
+    await db.flush()
 
     # Назначаем исполнителей
-    for user_id in request.assignee_ids:
-        user_result = await db.execute(select(User).where(User.id == user_id))
-        user = user_result.scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail=f"Пользователь {user_id} не найден")
-
-        task_assignment = TaskAssignment(
-            task_id=new_task.id,
-            user_id=user_id
-        )
-        db.add(task_assignment)
+    db.add_all([TaskAssignment(task_id=new_task.id, user_id=user_id) for user_id in assignee_ids])
 
     await db.commit()
+    await publish_task_created(db, new_task)
 
     return {"detail": "Задача успешно создана", "task_id": new_task.id}
 
+async def column_tail(db: AsyncSession, project_id: uuid.UUID, status_id: uuid.UUID):
+    # Последняя задача колонки: обратный проход по индексу (project_id, status_id, rank)
+    result = await db.execute(
+        select(Task.id, Task.rank)
+        .where(Task.project_id == project_id, Task.status_id == status_id)
+        .order_by(Task.rank.desc(), Task.id.desc())
+        .limit(1)
+    )
+    return result.first()
+
+
+async def rank_at_end(db: AsyncSession, project_id: uuid.UUID, status_id: uuid.UUID) -> str:
+    tail = await column_tail(db, project_id, status_id)
+    return rank_between(tail.rank if tail else None, None)
+
+
+def serialize_task(task, assignees: list):
+    priority = task_priorities.get(task.priority_id)
+    return {
+        "id": task.id,
+        "title": task.title,
+        "description": task.description,
+        "status_id": task.status_id,
+        "priority": {
+            "id": task.priority_id,
+            "title": priority.title if priority else None,
+        },
+        "deadline": task.deadline,
+        "assignees": assignees,
+    }
+
+
+async def publish_task_created(db: AsyncSession, task: Task):
+    assignees = await load_assignees(db, [task.id])
+    await publish_project_event(task.project_id, "task.created", {"task": serialize_task(task, assignees.get(task.id, []))})
+
+
+def board_task_columns():
+    return (Task.id, Task.title, Task.description, Task.status_id, Task.priority_id, Task.deadline, Task.rank)
+
+
+def tasks_after_cursor(rank: str, task_id: uuid.UUID):
+    return tuple_(Task.rank, Task.id) > tuple_(rank, task_id)
+
+
+def parse_board_cursor(cursor: str):
+    try:
+        status_id, rank, task_id = decode_cursor(cursor)
+        if not isinstance(rank, str):
+            raise ValueError("Invalid cursor")
+        return uuid.UUID(status_id), rank, uuid.UUID(task_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Некорректный курсор")
+
+
+async def load_assignees(db: AsyncSession, task_ids: List[uuid.UUID]) -> Dict[uuid.UUID, list]:
+    # Исполнители всех задач доски одним запросом
+    assignees: Dict[uuid.UUID, list] = defaultdict(list)
+    if not task_ids:
+        return assignees
+    result = await db.execute(
+        select(TaskAssignment.task_id, User.id, User.first_name, User.last_name, User.avatar)
+        .join(User, User.id == TaskAssignment.user_id)
+        .where(TaskAssignment.task_id.in_(task_ids))
+        .order_by(TaskAssignment.task_id, User.last_name, User.first_name)
+    )
+    for row in result:
+        assignees[row.task_id].append(
+            {"id": row.id, "name": f"{row.first_name} {row.last_name}", "avatar": f"{BASE_URL}/{row.avatar}"}
+        )
+    return assignees
+
+
 @router.get("/project/{project_id}")
-async def get_tasks_by_project(db: db_dependency, project_id: uuid.UUID):
-    statuses_result = await db.execute(select(TaskStatus))
-    statuses = statuses_result.scalars().all()
+async def get_tasks_by_project(
+    db: read_db_dependency,
+    project_id: uuid.UUID,
+    status_id: Optional[List[uuid.UUID]] = Query(None, description="Показать только эти колонки"),
+    limit: Optional[int] = Query(None, ge=1, le=BOARD_COLUMN_MAX_LIMIT, description="Количество задач в каждой колонке"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы колонки")
+):
+    statuses = task_statuses.all()
+    if cursor:
+        # Курсор продолжает одну колонку, поэтому остальные не загружаются
+        cursor_status_id, cursor_rank, cursor_task_id = parse_board_cursor(cursor)
+        status_id = [cursor_status_id]
+    if status_id:
+        requested = set(status_id)
+        statuses = [task_status for task_status in statuses if task_status.id in requested]
+        if len(statuses) != len(requested):
+            raise HTTPException(status_code=404, detail="Статус задачи не найден")
 
-    grouped_tasks = []
+    # Порядок индекса ix_tasks_project_id_status_id_rank, id различает задачи с одинаковым ключом
+    order = (Task.rank, Task.id)
+    query = select(*board_task_columns()).where(Task.project_id == project_id)
+    if status_id:
+        query = query.where(Task.status_id.in_([task_status.id for task_status in statuses]))
+    if cursor:
+        query = query.where(tasks_after_cursor(cursor_rank, cursor_task_id))
 
-    for status in statuses:
-        result = await db.execute(
-            select(Task)
-            .where(Task.project_id == project_id)
-            .where(Task.status_id == status.id)
+    if limit is not None:
+        # Первые limit + 1 задач каждой колонки: лишняя строка говорит, что есть следующая страница
+        position = func.row_number().over(partition_by=Task.status_id, order_by=order).label("position")
+        ranked = query.add_columns(position).subquery()
+        query = (
+            select(*(ranked.c[column.key] for column in board_task_columns()))
+            .where(ranked.c.position <= limit + 1)
+            .order_by(ranked.c.status_id, ranked.c.position)
         )
-        tasks = result.scalars().all()
+    else:
+        query = query.order_by(Task.status_id, *order)
 
-        tasks_data = []
-        for task in tasks:
-            assignees_result = await db.execute(
-                select(User).join(TaskAssignment).where(TaskAssignment.task_id == task.id)
-            )
-            assignees = assignees_result.scalars().all()
-
-            priority_title = (
-                await db.execute(
-                    select(TaskPriority.title).where(TaskPriority.id == task.priority_id)
-                )
-            ).scalar_one()
-
-            tasks_data.append({
-                "id": task.id,
-                "title": task.title,
-                "description": task.description,
-                "priority": {
-                    "id": task.priority_id,
-                    "title": priority_title,
-                },
-                "deadline": task.deadline,
-                "assignees": [
-                    {"id": u.id, "name": f"{u.first_name} {u.last_name}", "avatar": f"{BASE_URL}/{u.avatar}"}
-                    for u in assignees
-                ],
-            })
+    result = await db.execute(query)
+    tasks = result.fetchall()
+
+    columns = {task_status.id: [] for task_status in statuses}
+    for task in tasks:
+        if task.status_id in columns:
+            columns[task.status_id].append(task)
+
+    next_cursors = {}
+    if limit is not None:
+        for column_status_id, column_tasks in columns.items():
+            if len(column_tasks) > limit:
+                del column_tasks[limit:]
+                last = column_tasks[-1]
+                next_cursors[column_status_id] = encode_cursor(column_status_id, last.rank, last.id)
+
+    assignees = await load_assignees(db, [task.id for column_tasks in columns.values() for task in column_tasks])
+
+    grouped_tasks = []
+    for task_status in statuses:
+        tasks_data = [serialize_task(task, assignees.get(task.id, [])) for task in columns[task_status.id]]
 
         grouped_tasks.append({
             "status": {
-                "id": status.id,
-                "title": status.title,
+                "id": task_status.id,
+                "title": task_status.title,
             },
             "tasks": tasks_data,
+            "next_cursor": next_cursors.get(task_status.id),
         })
 
     return grouped_tasks
@@ -157,10 +264,7 @@ async def get_tasks_by_project(db: db_dependency, project_id: uuid.UUID):
 
 @router.post('/create-task-priority', summary="Создание нового приоритета задачи")
 async def create_task_priority(db: db_dependency, data: CreateTitleRequest):
-    query = select(TaskPriority).where(TaskPriority.title == data.title)
-    result = await db.execute(query)
-    task_priority = result.scalar_one_or_none()
-    if task_priority is not None:
+    if task_priorities.get_by_title(data.title) is not None:
             raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Приоритет задачи с таким названием уже есть в базе данных"
@@ -171,6 +275,7 @@ async def create_task_priority(db: db_dependency, data: CreateTitleRequest):
     db.add(task_priority)
     await db.commit()
     await db.refresh(task_priority)
+    await invalidate_reference(task_priorities)
 
 
 class UpdateTaskStatusRequest(BaseModel):
@@ -188,13 +293,223 @@ async def update_task_status(
     if not task:
         raise HTTPException(status_code=404, detail="Задача не найдена")
 
-    status_result = await db.execute(select(TaskStatus).where(TaskStatus.id == data.status_id))
-    status = status_result.scalar_one_or_none()
-    if not status:
+    if task_statuses.get(data.status_id) is None:
         raise HTTPException(status_code=404, detail="Статус не найден")
 
+    previous_status_id = task.status_id
+    if previous_status_id == data.status_id:
+        return {"detail": "Статус задачи обновлён", "task_id": task.id}
+
+    # Задача встаёт в конец новой колонки
+    tail = await column_tail(db, task.project_id, data.status_id)
     task.status_id = data.status_id
+    task.rank = rank_between(tail.rank if tail else None, None)
     await db.commit()
     await db.refresh(task)
 
+    await publish_project_event(task.project_id, "task.moved", {
+        "task_id": task.id,
+        "from_status_id": previous_status_id,
+        "status_id": task.status_id,
+        "after_id": tail.id if tail else None,
+        "before_id": None,
+    })
+
     return {"detail": "Статус задачи обновлён", "task_id": task.id}
+
+
+class MoveTaskRequest(BaseModel):
+    status_id: uuid.UUID
+    # Задачи, между которыми встаёт перемещаемая: выше и ниже неё; None - край колонки
+    after_id: Optional[uuid.UUID] = None
+    before_id: Optional[uuid.UUID] = None
+
+async def load_neighbour_ranks(db: AsyncSession, project_id: uuid.UUID, status_id: uuid.UUID, task_ids: List[uuid.UUID]):
+    if not task_ids:
+        return {}
+    result = await db.execute(
+        select(Task.id, Task.rank)
+        .where(Task.id.in_(task_ids), Task.project_id == project_id, Task.status_id == status_id)
+    )
+    return {row.id: row.rank for row in result}
+
+@router.put("/{task_id}/move", summary="Перемещение задачи на доске")
+async def move_task(
+    db: db_dependency,
+    task_id: uuid.UUID,
+    data: MoveTaskRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    task_result = await db.execute(select(Task.project_id, Task.status_id).where(Task.id == task_id))
+    task = task_result.first()
+    if not task:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+
+    if task_statuses.get(data.status_id) is None:
+        raise HTTPException(status_code=404, detail="Статус не найден")
+
+    neighbour_ids = [neighbour_id for neighbour_id in (data.after_id, data.before_id) if neighbour_id is not None]
+    if task_id in neighbour_ids or len(set(neighbour_ids)) != len(neighbour_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Некорректные соседние задачи")
+
+    ranks = await load_neighbour_ranks(db, task.project_id, data.status_id, neighbour_ids)
+    if len(ranks) != len(neighbour_ids):
+        raise HTTPException(status_code=404, detail="Соседняя задача не найдена в колонке")
+    lower, upper = ranks.get(data.after_id), ranks.get(data.before_id)
+
+    if lower is not None and lower == upper:
+        # Одинаковые ключи появляются при одновременном создании задач: колонка перенумеровывается сразу
+        await rebalance_column(db, task.project_id, data.status_id)
+        ranks = await load_neighbour_ranks(db, task.project_id, data.status_id, neighbour_ids)
+        lower, upper = ranks.get(data.after_id), ranks.get(data.before_id)
+    if lower is not None and upper is not None and lower >= upper:
+        # Перенумерация колонки сохраняется и при конфликте, иначе повтор упрётся в те же ключи
+        await db.commit()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Порядок задач изменился, обновите доску")
+
+    rank = rank_between(lower, upper)
+    await db.execute(
+        update(Task)
+        .where(Task.id == task_id)
+        .values(status_id=data.status_id, rank=rank)
+    )
+    await db.commit()
+
+    await publish_project_event(task.project_id, "task.moved", {
+        "task_id": task_id,
+        "from_status_id": task.status_id,
+        "status_id": data.status_id,
+        "after_id": data.after_id,
+        "before_id": data.before_id,
+    })
+
+    if len(rank) > TASK_RANK_REBALANCE_LENGTH:
+        rank_rebalancer.schedule(task.project_id, data.status_id)
+
+    return {"detail": "Задача перемещена", "task_id": task_id}
+
+
+class BulkTasksRequest(BaseModel):
+    task_ids: List[uuid.UUID]
+    status_id: Optional[uuid.UUID] = None
+    priority_id: Optional[uuid.UUID] = None
+    add_assignee_ids: List[uuid.UUID] = []
+    remove_assignee_ids: List[uuid.UUID] = []
+    delete: bool = False
+
+@router.post("/bulk", summary="Массовое изменение задач")
+async def bulk_update_tasks(
+    db: db_dependency,
+    data: BulkTasksRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    task_ids = list(dict.fromkeys(data.task_ids))
+    if not task_ids or len(task_ids) > BULK_TASKS_MAX_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Передайте от 1 до {BULK_TASKS_MAX_SIZE} задач")
+    if max(len(data.add_assignee_ids), len(data.remove_assignee_ids)) > BULK_ASSIGNEES_MAX_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Передайте не больше {BULK_ASSIGNEES_MAX_SIZE} исполнителей")
+    has_changes = (
+        data.status_id is not None or data.priority_id is not None
+        or data.add_assignee_ids or data.remove_assignee_ids
+    )
+    if data.delete:
+        # Удаление задач доступно тем же ролям, что и admin/delete-task
+        ensure_role(current_user, TASK_DELETE_ROLES)
+    if data.delete and has_changes:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Удаление нельзя совмещать с другими изменениями")
+    if not data.delete and not has_changes:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Не указано ни одного изменения")
+
+    # Проверки выполняются целиком до записи: справочники из кэша, исполнители одним запросом
+    if data.status_id is not None and task_statuses.get(data.status_id) is None:
+        raise HTTPException(status_code=404, detail="Статус не найден")
+    if data.priority_id is not None and task_priorities.get(data.priority_id) is None:
+        raise HTTPException(status_code=404, detail="Приоритет задачи не найден")
+    add_assignee_ids = await validate_assignees(db, data.add_assignee_ids)
+    remove_assignee_ids = list(dict.fromkeys(data.remove_assignee_ids))
+    if set(add_assignee_ids) & set(remove_assignee_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Исполнитель не может быть одновременно добавлен и удалён")
+
+    # Найденные задачи блокируются до конца транзакции в порядке доски
+    tasks_result = await db.execute(
+        select(Task.id, Task.project_id, Task.status_id)
+        .where(Task.id == any_(task_ids))
+        .order_by(Task.project_id, Task.status_id, Task.rank, Task.id)
+        .with_for_update()
+    )
+    tasks = tasks_result.all()
+    found_ids = [task.id for task in tasks]
+    outcome = "deleted" if data.delete else "updated"
+    results = {task_id: "not_found" for task_id in task_ids}
+    results.update({task_id: outcome for task_id in found_ids})
+
+    moves = []
+    long_rank_columns = set()
+    if found_ids and data.delete:
+        await db.execute(delete(Task).where(Task.id == any_(found_ids)))
+    elif found_ids:
+        if data.status_id is not None:
+            # Перемещённые задачи встают в конец новой колонки своего проекта, сохраняя взаимный порядок
+            rows = []
+            tails = {}
+            for task in tasks:
+                if task.status_id == data.status_id:
+                    continue
+                if task.project_id not in tails:
+                    tails[task.project_id] = await column_tail(db, task.project_id, data.status_id)
+                tail = tails[task.project_id]
+                rank = rank_between(tail.rank if tail else None, None)
+                rows.append({"id": task.id, "status_id": data.status_id, "rank": rank})
+                moves.append((task, tail.id if tail else None))
+                tails[task.project_id] = TaskRank(task.id, rank)
+                if len(rank) > TASK_RANK_REBALANCE_LENGTH:
+                    long_rank_columns.add((task.project_id, data.status_id))
+            if rows:
+                await db.execute(update(Task), rows)
+        if data.priority_id is not None:
+            await db.execute(
+                update(Task)
+                .where(Task.id == any_(found_ids))
+                .values(priority_id=data.priority_id)
+            )
+        if add_assignee_ids:
+            await db.execute(
+                insert(TaskAssignment)
+                .values([{"task_id": task_id, "user_id": user_id} for task_id in found_ids for user_id in add_assignee_ids])
+                .on_conflict_do_nothing()
+            )
+        if remove_assignee_ids:
+            await db.execute(
+                delete(TaskAssignment)
+                .where(TaskAssignment.task_id == any_(found_ids), TaskAssignment.user_id == any_(remove_assignee_ids))
+            )
+    await db.commit()
+
+    if data.delete:
+        for task in tasks:
+            await publish_project_event(task.project_id, "task.deleted", {"task_id": task.id})
+    for task, after_id in moves:
+        await publish_project_event(task.project_id, "task.moved", {
+            "task_id": task.id,
+            "from_status_id": task.status_id,
+            "status_id": data.status_id,
+            "after_id": after_id,
+            "before_id": None,
+        })
+    if found_ids and (data.priority_id is not None or add_assignee_ids or remove_assignee_ids):
+        # Карточки изменённых задач целиком: два запроса на весь пакет
+        cards_result = await db.execute(
+            select(Task.project_id, *board_task_columns()).where(Task.id == any_(found_ids))
+        )
+        cards = cards_result.all()
+        assignees = await load_assignees(db, found_ids)
+        for card in cards:
+            await publish_project_event(card.project_id, "task.updated", {"task": serialize_task(card, assignees.get(card.id, []))})
+
+    for project_id, status_id in long_rank_columns:
+        rank_rebalancer.schedule(project_id, status_id)
+
+    return {
+        "detail": "Задачи обработаны",
+        "results": [{"task_id": task_id, "result": results[task_id]} for task_id in task_ids],
+    }
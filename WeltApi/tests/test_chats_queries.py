@@ -0,0 +1,89 @@
+from query_stats import assert_query_budget, SERVER_TIMING_PATTERN
+
+# Список чатов, участники всех чатов страницы одним запросом, пользователи без чатов (только первая страница).
+# Пользователь из токена берётся из кэша, поэтому запросов авторизации здесь нет
+MY_CHATS_QUERY_BUDGET = 3
+MY_CHATS_NEXT_PAGE_QUERY_BUDGET = 2
+
+
+def query_count(response) -> int:
+    return int(SERVER_TIMING_PATTERN.search(response.headers["server-timing"]).group(1))
+
+
+def send_message(api, headers, chat_id):
+    response = api.post("/chats/send-message", json={"chat_id": chat_id, "text": "message"}, headers=headers)
+    assert response.status_code == 200, response.text
+
+
+def create_group_chats(api, headers, user_ids, count: int):
+    for index in range(count):
+        response = api.post("/chats/create-chat", json={
+            "name": f"Board {index}",
+            "is_group_chat": True,
+            "participants": user_ids,
+        }, headers=headers)
+        assert response.status_code == 200, response.text
+        send_message(api, headers, response.json()["id"])
+
+
+def create_private_chats(api, headers, user_ids):
+    for user_id in user_ids:
+        response = api.post("/chats/create-private-chat", json={"user_id": user_id}, headers=headers)
+        assert response.status_code == 200, response.text
+        send_message(api, headers, response.json()["id"])
+
+
+def my_chats(api, headers, query: str = ""):
+    response = api.get(f"/chats/my-chats{query}", headers=headers)
+    assert response.status_code == 200, response.text
+    return response
+
+
+def test_my_chats_query_count_does_not_grow_with_chats(api, create_user):
+    _, headers = create_user("alice")
+    user_ids = [create_user(name)[0] for name in ("bob", "carol", "dave")]
+
+    create_group_chats(api, headers, user_ids, 1)
+    few = my_chats(api, headers)
+    assert_query_budget(few, MY_CHATS_QUERY_BUDGET)
+
+    create_group_chats(api, headers, user_ids, 10)
+    create_private_chats(api, headers, user_ids)
+    many = my_chats(api, headers)
+    assert len(many.json()["chats"]) > len(few.json()["chats"])
+    assert_query_budget(many, MY_CHATS_QUERY_BUDGET)
+    assert query_count(many) == query_count(few)
+
+
+def test_my_chats_query_count_with_filter(api, create_user):
+    _, headers = create_user("alice")
+    user_ids = [create_user(name)[0] for name in ("bob", "carol")]
+    create_group_chats(api, headers, user_ids, 3)
+    create_private_chats(api, headers, user_ids)
+
+    unfiltered = my_chats(api, headers)
+    by_group_name = my_chats(api, headers, "?search_query=Board")
+    by_participant_name = my_chats(api, headers, "?search_query=Bob")
+
+    assert len(by_group_name.json()["chats"]) == 3
+    assert [chat["name"] for chat in by_participant_name.json()["chats"]] == ["Bob Test"]
+    # Фильтр по имени собеседника выполняется в том же SQL-запросе, что и список
+    for response in (unfiltered, by_group_name, by_participant_name):
+        assert_query_budget(response, MY_CHATS_QUERY_BUDGET)
+        assert query_count(response) == query_count(unfiltered)
+
+
+def test_my_chats_next_page_query_count(api, create_user):
+    _, headers = create_user("alice")
+    user_ids = [create_user(name)[0] for name in ("bob", "carol")]
+    create_group_chats(api, headers, user_ids, 8)
+
+    first = my_chats(api, headers, "?limit=3")
+    cursor = first.json()["next_cursor"]
+    assert cursor is not None
+    second = my_chats(api, headers, f"?limit=3&cursor={cursor}")
+    filtered = my_chats(api, headers, f"?limit=3&cursor={cursor}&search_query=Board")
+
+    assert_query_budget(first, MY_CHATS_QUERY_BUDGET)
+    assert_query_budget(second, MY_CHATS_NEXT_PAGE_QUERY_BUDGET)
+    assert_query_budget(filtered, MY_CHATS_NEXT_PAGE_QUERY_BUDGET)
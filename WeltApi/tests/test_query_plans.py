@@ -0,0 +1,204 @@
+import hashlib
+from uuid import UUID
+
+import pytest
+from sqlalchemy import select, func
+
+from chats import SEARCH_TS_CONFIG
+from database import async_session
+from models import Chat, ChatParticipant, Message, ProjectUser, Request, Task, TaskAssignment
+from tests.conftest import truncate_tables
+
+
+def seeded_id(kind: str, number: int) -> UUID:
+    # Те же id, что генерирует md5(kind || number)::uuid в SEED_STATEMENTS
+    return UUID(hashlib.md5(f"{kind}{number}".encode()).hexdigest())
+
+
+USER_ID = seeded_id("user", 1)
+CHAT_ID = seeded_id("chat", 1)
+PROJECT_ID = seeded_id("project", 1)
+STATUS_ID = seeded_id("status", 1)
+# Синхронизация читает только свежий хвост изменений
+RECENT_CHANGE_ID = 10 ** 9
+
+# Объёмы порядка небольшой установки: планировщик выбирает индекс по реальной статистике, а не наугад
+SEED_STATEMENTS = (
+    "INSERT INTO roles (id, title) VALUES (md5('role1')::uuid, 'USER')",
+    """
+    INSERT INTO users (id, first_name, last_name, email, password, role_id)
+    SELECT md5('user' || n)::uuid, 'User', n::text, 'user' || n || '@example.com', '', md5('role1')::uuid
+    FROM generate_series(1, 1000) n
+    """,
+    """
+    INSERT INTO chats (id, name, is_group_chat, last_message_at)
+    SELECT md5('chat' || n)::uuid, 'Chat ' || n, true, now() - n * interval '1 minute'
+    FROM generate_series(1, 2000) n
+    """,
+    """
+    INSERT INTO chat_participants (id, chat_id, user_id, last_message_at)
+    SELECT gen_random_uuid(), md5('chat' || c)::uuid, md5('user' || ((c + k * 250) % 1000 + 1))::uuid,
+           now() - c * interval '1 minute'
+    FROM generate_series(1, 2000) c, generate_series(0, 3) k
+    """,
+    """
+    INSERT INTO messages (id, text, sender_id, chat_id, sent_at, seq)
+    SELECT gen_random_uuid(), 'привет, сообщение ' || m, md5('user' || (m % 1000 + 1))::uuid,
+           md5('chat' || (m % 2000 + 1))::uuid, now() - m * interval '1 second', m / 2000 + 1
+    FROM generate_series(1, 40000) m
+    """,
+    # Первый чат - большой: в нём страница истории должна читаться по индексу без сортировки
+    """
+    INSERT INTO messages (id, text, sender_id, chat_id, sent_at, seq)
+    SELECT gen_random_uuid(), 'сообщение ' || m, md5('user' || (m % 4 + 1))::uuid,
+           md5('chat1')::uuid, now() - m * interval '1 second', 100 + m
+    FROM generate_series(1, 5000) m
+    """,
+    """
+    INSERT INTO projects (id, title)
+    SELECT md5('project' || n)::uuid, 'Project ' || n
+    FROM generate_series(1, 200) n
+    """,
+    """
+    INSERT INTO projects_users (id, project_id, user_id)
+    SELECT gen_random_uuid(), md5('project' || p)::uuid, md5('user' || ((p + k * 200) % 1000 + 1))::uuid
+    FROM generate_series(1, 200) p, generate_series(0, 4) k
+    """,
+    "INSERT INTO task_statuses (id, title) SELECT md5('status' || n)::uuid, 'Status ' || n FROM generate_series(1, 4) n",
+    "INSERT INTO task_priorities (id, title) SELECT md5('priority' || n)::uuid, 'Priority ' || n FROM generate_series(1, 3) n",
+    """
+    INSERT INTO tasks (id, title, project_id, status_id, priority_id, rank)
+    SELECT md5('task' || t)::uuid, 'Task ' || t, md5('project' || (t % 200 + 1))::uuid,
+           md5('status' || (t % 4 + 1))::uuid, md5('priority' || (t % 3 + 1))::uuid, lpad(t::text, 6, '0')
+    FROM generate_series(1, 20000) t
+    """,
+    """
+    INSERT INTO task_assignments (task_id, user_id)
+    SELECT md5('task' || t)::uuid, md5('user' || (t % 1000 + 1))::uuid
+    FROM generate_series(1, 20000) t
+    """,
+    "INSERT INTO request_statuses (id, title) VALUES (md5('request_status1')::uuid, 'New')",
+    """
+    INSERT INTO requests (project_id, status_id, subject, description, sender_id, receiver_id)
+    SELECT md5('project' || (r % 200 + 1))::uuid, md5('request_status1')::uuid, 'Request ' || r, '',
+           md5('user' || (r % 1000 + 1))::uuid, md5('user' || ((r + 500) % 1000 + 1))::uuid
+    FROM generate_series(1, 5000) r
+    """,
+    "ANALYZE",
+)
+
+# Горячие запросы API и индекс (или подходящие индексы), которым каждый из них должен пользоваться
+HOT_QUERIES = {
+    "my_chats_page": (
+        select(Chat.id, Chat.name, ChatParticipant.last_message_at, ChatParticipant.unread_count)
+        .join(ChatParticipant, Chat.id == ChatParticipant.chat_id)
+        .where(ChatParticipant.user_id == USER_ID, Chat.request_id.is_(None))
+        .order_by(ChatParticipant.last_message_at.desc().nulls_last(), ChatParticipant.chat_id.desc())
+        .limit(21),
+        "ix_chat_participants_user_id_last_message_at",
+    ),
+    "chat_members": (
+        select(ChatParticipant.user_id).where(ChatParticipant.chat_id == CHAT_ID),
+        "uq_chat_participants_chat_id_user_id",
+    ),
+    "chat_membership": (
+        select(ChatParticipant.id).where(ChatParticipant.chat_id == CHAT_ID, ChatParticipant.user_id == USER_ID),
+        "uq_chat_participants_chat_id_user_id",
+    ),
+    "chat_sync": (
+        select(ChatParticipant.chat_id).where(
+            ChatParticipant.user_id == USER_ID, ChatParticipant.change_id > RECENT_CHANGE_ID
+        ),
+        "ix_chat_participants_user_id_change_id",
+    ),
+    "chat_history_page": (
+        select(Message.id, Message.text, Message.sent_at)
+        .where(Message.chat_id == CHAT_ID)
+        .order_by(Message.sent_at.desc(), Message.id.desc())
+        .limit(51),
+        "ix_messages_chat_id_sent_at_id",
+    ),
+    "chat_replay": (
+        select(Message.id).where(Message.chat_id == CHAT_ID, Message.seq > 10).order_by(Message.seq),
+        "ix_messages_chat_id_seq",
+    ),
+    "message_sync": (
+        select(Message.id).where(Message.change_id > RECENT_CHANGE_ID).order_by(Message.change_id).limit(501),
+        "ix_messages_change_id",
+    ),
+    "message_search": (
+        select(Message.id).where(
+            Message.search_vector.bool_op("@@")(func.websearch_to_tsquery(SEARCH_TS_CONFIG, "сообщение 12345"))
+        ),
+        "ix_messages_search_vector",
+    ),
+    "board_column": (
+        select(Task.id)
+        .where(Task.project_id == PROJECT_ID, Task.status_id == STATUS_ID)
+        .order_by(Task.rank)
+        .limit(51),
+        "ix_tasks_project_id_status_id_rank",
+    ),
+    "user_task_assignments": (
+        select(TaskAssignment.task_id).where(TaskAssignment.user_id == USER_ID),
+        "ix_task_assignments_user_id",
+    ),
+    "user_projects": (
+        select(ProjectUser.project_id).where(ProjectUser.user_id == USER_ID),
+        "ix_projects_users_user_id",
+    ),
+    "project_membership": (
+        select(ProjectUser.id).where(ProjectUser.project_id == PROJECT_ID, ProjectUser.user_id == USER_ID),
+        # У пользователя немного проектов, поэтому поиск по user_id с фильтром не хуже уникального индекса
+        ("uq_projects_users_project_id_user_id", "ix_projects_users_user_id"),
+    ),
+    "received_requests": (
+        select(Request.id).where(Request.receiver_id == USER_ID),
+        "ix_requests_receiver_id",
+    ),
+    "sent_requests": (
+        select(Request.id).where(Request.sender_id == USER_ID),
+        "ix_requests_sender_id",
+    ),
+}
+
+
+async def seed_tables():
+    await truncate_tables()
+    async with async_session() as session:
+        connection = await session.connection()
+        for statement in SEED_STATEMENTS:
+            await connection.exec_driver_sql(statement)
+        await session.commit()
+
+
+async def explain(statement) -> str:
+    async with async_session() as session:
+        connection = await session.connection()
+        compiled = statement.compile(dialect=connection.dialect)
+        params = compiled.construct_params()
+        # Небольшие таблицы всё равно дешевле прочитать целиком; с выключенным seqscan
+        # планировщик показывает, какой из индексов он выбрал бы для запроса
+        await connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        result = await connection.exec_driver_sql(
+            f"EXPLAIN {compiled}", tuple(params[name] for name in compiled.positiontup)
+        )
+        plan = "\n".join(row[0] for row in result)
+        await session.rollback()
+    return plan
+
+
+@pytest.fixture(scope="module")
+def seeded(client):
+    client.portal.call(seed_tables)
+    return client
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_query_uses_index(seeded, name):
+    statement, indexes = HOT_QUERIES[name]
+    if isinstance(indexes, str):
+        indexes = (indexes,)
+    plan = seeded.portal.call(explain, statement)
+    assert any(index in plan for index in indexes), f"{name} не использует {' или '.join(indexes)}:\n{plan}"
+    assert "Seq Scan" not in plan, f"{name} читает таблицу целиком:\n{plan}"
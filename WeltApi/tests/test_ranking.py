@@ -0,0 +1,66 @@
+import bisect
+import random
+
+import pytest
+
+from ranking import DIGITS, rank_between, spaced_ranks
+
+
+def assert_valid_keys(keys):
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+    assert not any(key.endswith(DIGITS[0]) for key in keys), [key for key in keys if key.endswith(DIGITS[0])]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_insertions_keep_keys_ordered(seed):
+    rng = random.Random(seed)
+    keys = []
+    for _ in range(2000):
+        position = rng.randint(0, len(keys))
+        lower = keys[position - 1] if position > 0 else None
+        upper = keys[position] if position < len(keys) else None
+        key = rank_between(lower, upper)
+        assert lower is None or lower < key
+        assert upper is None or key < upper
+        keys.insert(position, key)
+    assert_valid_keys(keys)
+
+
+def test_insertions_at_column_edges():
+    # Перенос в начало или конец колонки - самый частый случай на доске
+    keys = [rank_between(None, None)]
+    for _ in range(500):
+        keys.append(rank_between(keys[-1], None))
+        keys.insert(0, rank_between(None, keys[0]))
+    assert_valid_keys(keys)
+
+
+def test_repeated_insertions_between_neighbours():
+    # Задачу раз за разом ставят сразу после одной и той же: ключи удлиняются, но порядок сохраняется
+    lower = rank_between(None, None)
+    upper = rank_between(lower, None)
+    keys = [lower, upper]
+    for _ in range(500):
+        key = rank_between(lower, upper)
+        bisect.insort(keys, key)
+        upper = key
+    assert_valid_keys(keys)
+
+
+@pytest.mark.parametrize("lower, upper", [("V", "V"), ("b", "a"), ("a1", "a")])
+def test_rank_between_rejects_unordered_bounds(lower, upper):
+    with pytest.raises(ValueError):
+        rank_between(lower, upper)
+
+
+# Границы, где ключам перестаёт хватать одной или двух цифр
+@pytest.mark.parametrize("count", [1, 2, 61, 62, 3843, 3844])
+def test_spaced_ranks_are_ordered_and_unique(count):
+    ranks = spaced_ranks(count)
+    assert len(ranks) == count
+    assert all(ranks)
+    assert_valid_keys(ranks)
+    # Между соседними ключами после перебалансировки снова можно вставлять
+    for lower, upper in zip(ranks, ranks[1:]):
+        assert lower < rank_between(lower, upper) < upper
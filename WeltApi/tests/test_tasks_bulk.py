@@ -0,0 +1,180 @@
+import uuid
+
+import pytest
+
+from query_stats import assert_query_budget
+from reference_data import task_priorities, task_statuses
+from tests.test_chats_queries import query_count
+
+# Проверка исполнителей, блокировка задач, хвост колонки проекта, перенос, приоритет, вставка исполнителей,
+# затем карточки и исполнители для событий доски. От числа задач в пакете не зависит
+BULK_UPDATE_QUERY_BUDGET = 8
+
+
+def create_project(api, headers, title: str):
+    response = api.post("/admin/create-project", data={"title": title}, headers=headers)
+    assert response.status_code == 200, response.text
+    projects = api.get("/projects/my-projects", headers=headers).json()
+    return next(project["id"] for project in projects if project["title"] == title)
+
+
+def create_status(api, title: str):
+    response = api.post("/tasks/create-task-status", json={"title": title})
+    assert response.status_code == 200, response.text
+    return str(task_statuses.get_by_title(title).id)
+
+
+def create_priority(api, title: str):
+    response = api.post("/tasks/create-task-priority", json={"title": title})
+    assert response.status_code == 200, response.text
+    return str(task_priorities.get_by_title(title).id)
+
+
+@pytest.fixture
+def board(api, create_user):
+    _, headers = create_user("alice")
+    return {
+        "headers": headers,
+        "todo": create_status(api, "Todo"),
+        "done": create_status(api, "Done"),
+        "low": create_priority(api, "Low"),
+        "high": create_priority(api, "High"),
+    }
+
+
+def create_task(api, board, project_id, title: str, status: str = "todo"):
+    response = api.post("/tasks/create", json={
+        "title": title,
+        "project_id": project_id,
+        "status_id": board[status],
+        "priority_id": board["low"],
+        "deadline": "2030-01-01T00:00:00Z",
+    }, headers=board["headers"])
+    assert response.status_code == 200, response.text
+    return response.json()["task_id"]
+
+
+def create_tasks(api, board, project_id, count: int, prefix: str = "Task"):
+    return [create_task(api, board, project_id, f"{prefix} {index}") for index in range(count)]
+
+
+def bulk(api, headers, payload: dict, expected_status: int = 200):
+    response = api.post("/tasks/bulk", json=payload, headers=headers)
+    assert response.status_code == expected_status, response.text
+    return response
+
+
+def column_titles(api, project_id, status_id):
+    response = api.get(f"/tasks/project/{project_id}", params={"status_id": status_id})
+    assert response.status_code == 200, response.text
+    return [task["title"] for task in response.json()[0]["tasks"]]
+
+
+def test_delete_cannot_be_combined_with_other_changes(api, board):
+    project_id = create_project(api, board["headers"], "Project")
+    task_ids = create_tasks(api, board, project_id, 2)
+
+    for change in ({"status_id": board["done"]}, {"priority_id": board["high"]}, {"remove_assignee_ids": [str(uuid.uuid4())]}):
+        bulk(api, board["headers"], {"task_ids": task_ids, "delete": True, **change}, 400)
+    assert len(column_titles(api, project_id, board["todo"])) == 2
+
+
+def test_empty_request_is_rejected(api, board):
+    project_id = create_project(api, board["headers"], "Project")
+    task_ids = create_tasks(api, board, project_id, 1)
+
+    bulk(api, board["headers"], {"task_ids": task_ids}, 400)
+    bulk(api, board["headers"], {"task_ids": [], "priority_id": board["high"]}, 400)
+
+
+@pytest.mark.parametrize("role, expected_status", [("USER", 403), ("MODERATOR", 200)])
+def test_delete_requires_role(api, create_user, board, role, expected_status):
+    project_id = create_project(api, board["headers"], "Project")
+    task_ids = create_tasks(api, board, project_id, 2)
+    _, headers = create_user("bob", role=role)
+
+    bulk(api, headers, {"task_ids": task_ids, "delete": True}, expected_status)
+    remaining = 2 if expected_status == 403 else 0
+    assert len(column_titles(api, project_id, board["todo"])) == remaining
+
+
+def test_assignee_cannot_be_added_and_removed(api, create_user, board):
+    project_id = create_project(api, board["headers"], "Project")
+    task_ids = create_tasks(api, board, project_id, 2)
+    bob_id, _ = create_user("bob")
+    carol_id, _ = create_user("carol")
+
+    bulk(api, board["headers"], {
+        "task_ids": task_ids,
+        "add_assignee_ids": [bob_id, carol_id],
+        "remove_assignee_ids": [carol_id],
+    }, 400)
+    response = api.get(f"/tasks/project/{project_id}")
+    assert all(not task["assignees"] for column in response.json() for task in column["tasks"])
+
+
+def test_missing_tasks_are_reported_per_item(api, board):
+    project_id = create_project(api, board["headers"], "Project")
+    task_ids = create_tasks(api, board, project_id, 2)
+    missing_id = str(uuid.uuid4())
+
+    response = bulk(api, board["headers"], {
+        "task_ids": [task_ids[0], missing_id, task_ids[1], task_ids[0]],
+        "priority_id": board["high"],
+    })
+    assert response.json()["results"] == [
+        {"task_id": task_ids[0], "result": "updated"},
+        {"task_id": missing_id, "result": "not_found"},
+        {"task_id": task_ids[1], "result": "updated"},
+    ]
+    tasks = api.get(f"/tasks/project/{project_id}").json()[0]["tasks"]
+    assert {task["priority"]["id"] for task in tasks} == {board["high"]}
+
+    response = bulk(api, board["headers"], {"task_ids": [missing_id], "delete": True})
+    assert response.json()["results"] == [{"task_id": missing_id, "result": "not_found"}]
+
+
+def test_moved_tasks_go_to_the_end_of_each_project_column(api, board):
+    first_project = create_project(api, board["headers"], "First")
+    second_project = create_project(api, board["headers"], "Second")
+    create_task(api, board, first_project, "First done", status="done")
+    create_task(api, board, second_project, "Second done", status="done")
+    first_ids = create_tasks(api, board, first_project, 3, "First")
+    second_ids = create_tasks(api, board, second_project, 2, "Second")
+
+    # Порядок в запросе не важен: задачи сохраняют взаимный порядок своей колонки
+    bulk(api, board["headers"], {
+        "task_ids": [second_ids[1], first_ids[2], first_ids[0], second_ids[0], first_ids[1]],
+        "status_id": board["done"],
+    })
+    assert column_titles(api, first_project, board["done"]) == ["First done", "First 0", "First 1", "First 2"]
+    assert column_titles(api, second_project, board["done"]) == ["Second done", "Second 0", "Second 1"]
+    assert column_titles(api, first_project, board["todo"]) == []
+
+    # Новая задача после пакетного переноса встаёт за перенесёнными
+    create_task(api, board, first_project, "First new", status="done")
+    assert column_titles(api, first_project, board["done"])[-1] == "First new"
+
+
+def test_bulk_update_query_count_does_not_grow_with_tasks(api, create_user, board):
+    project_id = create_project(api, board["headers"], "Project")
+    bob_id, _ = create_user("bob")
+    carol_id, _ = create_user("carol")
+
+    counts = []
+    for size in (2, 20):
+        task_ids = create_tasks(api, board, project_id, size, f"Batch {size}")
+        responses = [
+            bulk(api, board["headers"], {
+                "task_ids": task_ids,
+                "status_id": board["done"],
+                "priority_id": board["high"],
+                "add_assignee_ids": [bob_id, carol_id],
+            }),
+            bulk(api, board["headers"], {"task_ids": task_ids, "remove_assignee_ids": [carol_id]}),
+            bulk(api, board["headers"], {"task_ids": task_ids, "delete": True}),
+        ]
+        for response in responses:
+            assert_query_budget(response, BULK_UPDATE_QUERY_BUDGET)
+        counts.append([query_count(response) for response in responses])
+    assert counts[0] == counts[1]
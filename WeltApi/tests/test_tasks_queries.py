@@ -0,0 +1,49 @@
+from query_stats import assert_query_budget
+from tests.test_chats_queries import query_count
+from tests.test_tasks_bulk import board, bulk, create_project, create_tasks
+
+# Задачи всех колонок одним запросом и исполнители всех задач доски вторым
+BOARD_QUERY_BUDGET = 2
+
+
+def project_board(api, project_id, params: dict = None):
+    response = api.get(f"/tasks/project/{project_id}", params=params)
+    assert response.status_code == 200, response.text
+    return response
+
+
+def fill_board(api, create_user, board, project_id, count: int):
+    assignee_ids = [create_user(name)[0] for name in ("bob", "carol")]
+    task_ids = create_tasks(api, board, project_id, count)
+    bulk(api, board["headers"], {"task_ids": task_ids[::2], "status_id": board["done"]})
+    bulk(api, board["headers"], {"task_ids": task_ids, "add_assignee_ids": assignee_ids})
+
+
+def test_board_query_count_does_not_grow_with_tasks(api, create_user, board):
+    small_project = create_project(api, board["headers"], "Small")
+    large_project = create_project(api, board["headers"], "Large")
+    fill_board(api, create_user, board, small_project, 2)
+    create_tasks(api, board, large_project, 30)
+
+    small = project_board(api, small_project)
+    large = project_board(api, large_project)
+    assert sum(len(column["tasks"]) for column in large.json()) == 30
+    for response in (small, large):
+        assert_query_budget(response, BOARD_QUERY_BUDGET)
+    assert query_count(large) == query_count(small)
+
+
+def test_board_page_query_count(api, create_user, board):
+    project_id = create_project(api, board["headers"], "Project")
+    fill_board(api, create_user, board, project_id, 10)
+
+    first = project_board(api, project_id, {"limit": 2})
+    cursor = first.json()[0]["next_cursor"]
+    assert cursor is not None
+    second = project_board(api, project_id, {"limit": 2, "cursor": cursor})
+    filtered = project_board(api, project_id, {"limit": 2, "status_id": board["done"]})
+
+    assert [len(column["tasks"]) for column in first.json()] == [2, 2]
+    assert len(second.json()[0]["tasks"]) == 2
+    for response in (first, second, filtered):
+        assert_query_budget(response, BOARD_QUERY_BUDGET)
@@ -1,9 +1,18 @@
+import asyncio
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Union, Any, Optional
+from typing import Union, Any, Optional, List
+from uuid import UUID
 
+from fastapi import HTTPException
 from jose import jwt
 from passlib.context import CryptContext
+from starlette import status
 
+import settings
+from metrics import Counter, Gauge
 from settings import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, JWT_SECRET_KEY, REFRESH_TOKEN_EXPIRE_MINUTES, \
     JWT_REFRESH_SECRET_KEY
 
@@ -15,13 +24,49 @@ def get_hashed_password(password: str) -> str:
 def verify_password(password: str, hashed_pass: str) -> bool:
     return password_context.verify(password, hashed_pass)
 
-def create_access_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None) -> str:
+
+class PasswordWorkerPool:
+    # bcrypt отпускает GIL, поэтому хеширование в потоках не блокирует event loop.
+    # Одновременно выполняется не больше workers задач и ждёт не больше queue_size,
+    # остальные запросы сразу получают 503, а не копятся в очереди
+    def __init__(self, workers: int, queue_size: int):
+        self.limit = workers + queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        self.pending = 0
+
+    async def run(self, function, *args):
+        if self.pending >= self.limit:
+            password_jobs_rejected.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Сервер перегружен, повторите попытку позже",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.pending -= 1
+
+
+password_pool = PasswordWorkerPool(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_SIZE)
+
+password_jobs_rejected = Counter("welt_password_jobs_rejected_total", "Password hashing jobs rejected because the pool was full")
+Gauge("welt_password_jobs_pending", "Password hashing jobs running or waiting", function=lambda: password_pool.pending)
+
+async def get_hashed_password_async(password: str) -> str:
+    return await password_pool.run(get_hashed_password, password)
+
+async def verify_password_async(password: str, hashed_pass: str) -> bool:
+    return await password_pool.run(verify_password, password, hashed_pass)
+
+def create_access_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None, claims: Optional[dict] = None) -> str:
     if expires_delta is not None:
         expires_delta = datetime.now(timezone.utc) + expires_delta
     else:
         expires_delta = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
-    to_encode = {"exp": expires_delta, "sub": str(subject)}
+    to_encode = {**(claims or {}), "exp": expires_delta, "sub": str(subject)}
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, ALGORITHM)
     return encoded_jwt
 
@@ -33,4 +78,23 @@ def create_refresh_token(subject: Union[str, Any], expires_delta: Optional[timed
 
     to_encode = {"exp": expires_delta, "sub": str(subject)}
     encoded_jwt = jwt.encode(to_encode, JWT_REFRESH_SECRET_KEY, ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
+
+def encode_cursor(*values: Any) -> str:
+    # Курсор для keyset-пагинации: значения ключа сортировки, упакованные в base64
+    prepared = [
+        value.isoformat() if isinstance(value, datetime) else str(value) if isinstance(value, UUID) else value
+        for value in values
+    ]
+    raw = json.dumps(prepared, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values